@@ -0,0 +1,421 @@
+#!/usr/bin/python
+'''
+    This file is part of nodereviver
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    @author: Vincent Petry <PVince81@yahoo.fr>
+'''
+import glob
+import optparse
+import os
+import random
+import math
+import re
+import sys
+import time
+
+from nodereviver import model
+from nodereviver.algo import PathFinder, IncrementalPathFinder
+from nodereviver.WorldLoaderJson import WorldLoader
+from nodereviver.replay import loadScripts, runScript
+
+def makeGridWorld(size, jointRatio = 0.2, seed = 0):
+    '''
+    Generates a square grid world of size x size nodes where
+    neighbour nodes are connected. Some connections go through a joint
+    node placed in the middle of the edge.
+    @param size: number of nodes per row and column
+    @param jointRatio: ratio of connections having a joint
+    @param seed: random seed, to generate the same world every time
+    '''
+    rand = random.Random(seed)
+    world = model.World()
+    spacing = 40
+    grid = []
+    for y in range(size):
+        row = []
+        for x in range(size):
+            row.append(world.createNode((x * spacing, y * spacing)))
+        grid.append(row)
+
+    for y in range(size):
+        for x in range(size):
+            node = grid[y][x]
+            neighbours = []
+            if x < size - 1:
+                neighbours.append(grid[y][x + 1])
+            if y < size - 1:
+                neighbours.append(grid[y + 1][x])
+            for other in neighbours:
+                if rand.random() < jointRatio:
+                    middle = ((node.pos[0] + other.pos[0]) / 2, (node.pos[1] + other.pos[1]) / 2)
+                    joint = world.createNode(middle, model.Node.JOINT)
+                    world.connectNodeWithJoint(node, joint)
+                    world.connectNodeWithJoint(joint, other)
+                else:
+                    world.connectNodeWithJoint(node, other)
+    world.startNode = grid[0][0]
+    return world
+
+def makeQueries(world, count, seed = 0):
+    '''
+    Returns a list of random (start, goal) pairs of square nodes.
+    '''
+    rand = random.Random(seed)
+    squares = [node for node in world.nodes if node.type == model.Node.SQUARE]
+    return [(rand.choice(squares), rand.choice(squares)) for i in range(count)]
+
+class LinearPathFinder(PathFinder):
+    '''
+    Reference A* implementation which scans the whole open set to find
+    the lowest score and walks the world edge by edge, as it used to be
+    done before the binary heap and the contracted navigation graph.
+    '''
+
+    def lowest(self, list, scores):
+        min = 999999999999
+        curNode = None
+        for node in list:
+            score = scores[node]
+            if score < min:
+                curNode = node
+                min = score
+        return curNode
+
+    def findShortestPath(self, start, goal):
+        closedset = set()
+        openset = set([start])
+        self.came_from = {}
+
+        g_score = {}
+        h_score = {}
+        f_score = {}
+        g_score[start] = 0
+        h_score[start] = self.h(start, goal)
+        f_score[start] = g_score[start] + h_score[start]
+
+        while len(openset) > 0:
+            current = self.lowest(openset, f_score)
+            if current == goal:
+                return self.reconstruct_path(start, goal)
+
+            openset.remove(current)
+            closedset.add(current)
+            self.totalStats.expansions += 1
+            for edge in current.getOutgoingEdges():
+                neighbor = edge.getOther(current)
+                if neighbor in closedset:
+                    continue
+                tentative_g_score = g_score[current] + edge.length
+
+                if neighbor not in openset:
+                    openset.add(neighbor)
+                    h_score[neighbor] = self.h(neighbor, goal)
+                    tentative_is_better = True
+                elif tentative_g_score < g_score[neighbor]:
+                    tentative_is_better = True
+                else:
+                    tentative_is_better = False
+
+                if tentative_is_better:
+                    self.came_from[neighbor] = edge
+                    g_score[neighbor] = tentative_g_score
+                    f_score[neighbor] = g_score[neighbor] + h_score[neighbor]
+
+        return None
+
+    def reconstruct_path(self, sourceNode, node):
+        path = []
+        while self.came_from.has_key(node):
+            edge = self.came_from[node]
+            path.append(edge)
+            node = edge.getOther(node)
+        path.reverse()
+
+        # remove joint nodes
+        finalEdges = []
+        node = sourceNode
+        for edge in path:
+            if node.type != model.Node.JOINT:
+                finalEdges.append(edge)
+            node = edge.getOther(node)
+
+        return finalEdges
+
+class LegacyHeuristicPathFinder(PathFinder):
+    '''
+    A* with the heuristic used before the Manhattan distance:
+    abs(dx + dy) is admissible as well, but a looser bound, so more
+    nodes get expanded.
+    '''
+
+    def h(self, source, target):
+        return abs(source.pos[0] - target.pos[0] + source.pos[1] - target.pos[1])
+
+def _runQueries(pathFinder, queries):
+    startTime = time.time()
+    for start, goal in queries:
+        pathFinder.findShortestPath(start, goal)
+    elapsed = (time.time() - startTime) * 1000.0
+    return pathFinder.totalStats.expansions, elapsed
+
+def benchPathFinder(sizes, queriesCount):
+    '''
+    Compares the expansions per millisecond of the linear scan and the
+    binary heap A* implementations on the same generated worlds.
+    '''
+    print "%-8s %-8s %-10s %14s %14s %8s" % ("nodes", "edges", "finder", "expansions", "time (ms)", "exp/ms")
+    for size in sizes:
+        world = makeGridWorld(size)
+        # the contracted graph is built once per world, leave it out
+        world.getNavigationGraph()
+        queries = makeQueries(world, queriesCount)
+        for name, pathFinder in [("linear", LinearPathFinder(0)), ("heap", PathFinder(0))]:
+            expansions, elapsed = _runQueries(pathFinder, queries)
+            print "%-8i %-8i %-10s %14i %14.1f %8.1f" % (len(world.nodes), len(world.edges), name, expansions, elapsed, expansions / max(elapsed, 0.001))
+
+def benchReplan(sizes, steps):
+    '''
+    Compares the average number of nodes touched (expanded or pushed to
+    the open set) per replan by the incremental path finder and plain
+    A*, while chasing a target that moves by one corridor at every step.
+    '''
+    print "%-8s %-8s %-12s %10s %16s" % ("nodes", "edges", "finder", "replans", "touched/replan")
+    for size in sizes:
+        world = makeGridWorld(size)
+        graph = world.getNavigationGraph()
+        rand = random.Random(0)
+        squares = [node for node in world.nodes if node.type == model.Node.SQUARE]
+        target = rand.choice(squares)
+        chaser = rand.choice(squares)
+        incremental = IncrementalPathFinder()
+        pathFinder = PathFinder(0)
+        replans = 0
+        for step in range(steps):
+            target = rand.choice(graph.getOutgoing(target)).destination
+            if target == chaser:
+                continue
+            replans += 1
+            path = incremental.findShortestPath(chaser, target)
+            pathFinder.findShortestPath(chaser, target)
+            # the chaser moves one corridor closer every other step
+            if path and step % 2 == 0:
+                chaser = graph.getCorridor(chaser, path[0]).destination
+
+        replans = max(replans, 1)
+        print "%-8i %-8i %-12s %10i %16.1f" % (len(world.nodes), len(world.edges), "a*", replans, float(pathFinder.totalStats.expansions + pathFinder.totalStats.pushes) / replans)
+        print "%-8i %-8i %-12s %10i %16.1f" % (len(world.nodes), len(world.edges), "incremental", replans, float(incremental.touched) / replans)
+
+def benchBuild(sizes):
+    '''
+    Measures the time needed to build generated worlds.
+    '''
+    print "%-8s %-8s %12s" % ("nodes", "edges", "time (ms)")
+    for size in sizes:
+        startTime = time.time()
+        world = makeGridWorld(size)
+        elapsed = (time.time() - startTime) * 1000.0
+        print "%-8i %-8i %12.1f" % (len(world.nodes), len(world.edges), elapsed)
+
+def _objectSize(obj):
+    '''
+    Returns the size in bytes of the given object including its
+    attribute dictionary, if any.
+    '''
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def benchMemory(edgeCounts):
+    '''
+    Measures the memory used by the nodes and edges of generated worlds
+    having about the given numbers of edges.
+    '''
+    print "%-8s %-8s %12s %12s %14s" % ("nodes", "edges", "bytes/node", "bytes/edge", "total (KiB)")
+    for edgeCount in edgeCounts:
+        # a grid of size x size nodes has about 2.4 * size^2 edges
+        # with the default joint ratio
+        size = max(2, int(math.sqrt(edgeCount / 2.4)))
+        world = makeGridWorld(size)
+        nodesSize = 0
+        for node in world.nodes:
+            nodesSize += _objectSize(node) + sys.getsizeof(node.edges) + sys.getsizeof(node.pos)
+        edgesSize = 0
+        for edge in world.edges:
+            edgesSize += _objectSize(edge)
+        print "%-8i %-8i %12.1f %12.1f %14.1f" % (len(world.nodes), len(world.edges), float(nodesSize) / len(world.nodes), float(edgesSize) / len(world.edges), (nodesSize + edgesSize) / 1024.0)
+
+def benchTicks(sizes, ticks, foesCount = 5):
+    '''
+    Measures the number of World.update() ticks per second without any
+    display or sound, with a player wandering randomly and the given
+    number of simple and tracking foes, with entities moved one by one
+    and moved by NumPy if available.
+    '''
+    if "pygame" in sys.modules:
+        print "Warning: pygame was imported, the simulation is not headless"
+    modes = [("python", None)]
+    if model.numpy:
+        modes.append(("numpy", 0))
+    print "%-8s %-8s %-8s %-8s %10s %12s %12s" % ("nodes", "edges", "entities", "update", "ticks", "time (ms)", "ticks/s")
+    for size in sizes:
+        for name, threshold in modes:
+            world = makeGridWorld(size)
+            world.BATCH_THRESHOLD = threshold
+            rand = random.Random(0)
+            world.random.seed(0)
+            squares = [node for node in world.nodes if node.type == model.Node.SQUARE]
+            player = model.Player(world.startNode)
+            world.addEntity(player)
+            for i in range(foesCount):
+                world.createSimpleFoe(rand.choice(squares))
+                world.createTrackingFoe(rand.choice(squares))
+            for entity in world.entities:
+                if entity.entityType == 1 and entity.foeType == 1:
+                    entity.track(player)
+
+            startTime = time.time()
+            for tick in range(ticks):
+                if not player.moving:
+                    player.moveAlong(rand.choice(player.currentNode.getOutgoingEdges()))
+                world.update()
+            elapsed = (time.time() - startTime) * 1000.0
+            print "%-8i %-8i %-8i %-8s %10i %12.1f %12.1f" % (len(world.nodes), len(world.edges), len(world.entities), name, ticks, elapsed, ticks * 1000.0 / max(elapsed, 0.001))
+
+def benchReplay(fileNames, dataPath):
+    '''
+    Replays recorded level attempts without display, checks that each one
+    ends the same way and at the same tick as when it was recorded, and
+    measures the tick rate.
+    '''
+    if "pygame" in sys.modules:
+        print "Warning: pygame was imported, the simulation is not headless"
+    loader = WorldLoader(dataPath)
+    print "%-24s %-6s %-6s %8s %-10s %12s %12s %-6s" % ("file", "level", "moves", "ticks", "result", "time (ms)", "ticks/s", "check")
+    errors = 0
+    totalTicks = 0
+    totalTime = 0.0
+    for fileName in fileNames:
+        for script in loadScripts(fileName):
+            if not script.isDeterministic():
+                print "Warning: skipping level %i of %s, recorded with incremental tracking by an older version" % (script.worldNum, fileName)
+                continue
+            world = loader.loadWorld(script.worldNum)
+            startTime = time.time()
+            result, ticks = runScript(world, script)
+            elapsed = (time.time() - startTime) * 1000.0
+            if result == script.result and ticks == script.ticks:
+                check = "ok"
+            else:
+                check = "FAILED"
+                errors += 1
+            totalTicks += ticks
+            totalTime += elapsed
+            print "%-24s %-6i %-6i %8i %-10s %12.1f %12.1f %-6s" % (os.path.basename(fileName), script.worldNum, len(script.moves), ticks, result, elapsed, ticks * 1000.0 / max(elapsed, 0.001), check)
+    print "total: %i ticks in %.1f ms (%.1f ticks/s), %i errors" % (totalTicks, totalTime, totalTicks * 1000.0 / max(totalTime, 0.001), errors)
+
+def validateLevels(dataPath):
+    '''
+    Runs A* between all square nodes of every level and checks the
+    results against an exhaustive Dijkstra search, for every heuristic.
+    '''
+    levelNumbers = []
+    for fileName in glob.glob(os.path.join(dataPath, "level*.json")):
+        match = re.match(r"level(\d+)\.json$", os.path.basename(fileName))
+        if match:
+            levelNumbers.append(int(match.group(1)))
+    levelNumbers.sort()
+
+    loader = WorldLoader(dataPath)
+    worlds = [loader.loadWorld(num) for num in levelNumbers]
+    print "%-12s %8s %12s %10s %12s %8s" % ("heuristic", "queries", "expansions", "pushes", "time (ms)", "errors")
+    for name, pathFinder in [("legacy", LegacyHeuristicPathFinder(0, True)), ("manhattan", PathFinder(0, True))]:
+        for world in worlds:
+            squares = [node for node in world.nodes if node.type == model.Node.SQUARE]
+            for start in squares:
+                for goal in squares:
+                    pathFinder.findShortestPath(start, goal)
+        stats = pathFinder.totalStats
+        print "%-12s %8i %12i %10i %12.1f %8i" % (name, stats.queries, stats.expansions, stats.pushes, stats.wallTime * 1000.0, pathFinder.validationErrors)
+
+def main():
+    parser = optparse.OptionParser(description='Node Reviver benchmarks')
+    parser.add_option('--pathfinder', action="store_true", default=False,
+                        dest='pathFinder',
+                        help='benchmark the A* path finder')
+    parser.add_option('--replan', action="store_true", default=False,
+                        dest='replan',
+                        help='benchmark incremental replanning for a moving target')
+    parser.add_option('--build', action="store_true", default=False,
+                        dest='build',
+                        help='benchmark the construction of worlds')
+    parser.add_option('--memory', action="store_true", default=False,
+                        dest='memory',
+                        help='measure the memory used by the nodes and edges')
+    parser.add_option('--ticks', action="store_true", default=False,
+                        dest='ticks',
+                        help='measure the ticks per second of the headless simulation')
+    parser.add_option('--validate', action="store_true", default=False,
+                        dest='validate',
+                        help='check A* against Dijkstra on every level')
+    parser.add_option('--replay', action="store", default=None,
+                        dest='replay', type=str,
+                        help='comma separated files recorded with nodereviver.py --record to replay and check')
+    parser.add_option('--datapath', action="store", default="data/",
+                        dest='dataPath', type=str,
+                        help='specifies the data path')
+    parser.add_option('--sizes', action="store", default=None,
+                        dest='sizes', type=str,
+                        help='comma separated grid sizes of the generated worlds (edge counts for --memory)')
+    parser.add_option('--queries', action="store", default=20,
+                        dest='queries', type=int,
+                        help='number of path queries per world')
+    parser.add_option('--steps', action="store", default=200,
+                        dest='steps', type=int,
+                        help='number of target moves for the replan benchmark')
+    parser.add_option('--foes', action="store", default=5,
+                        dest='foes', type=int,
+                        help='number of simple and of tracking foes for the tick rate benchmark')
+    parser.add_option('--tickcount', action="store", default=20000,
+                        dest='tickCount', type=int,
+                        help='number of ticks for the tick rate benchmark')
+    (args, rest) = parser.parse_args()
+
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(",")]
+    elif args.memory:
+        sizes = [1000, 10000, 100000]
+    else:
+        sizes = [10, 30, 70]
+    if args.pathFinder:
+        benchPathFinder(sizes, args.queries)
+    elif args.replan:
+        benchReplan(sizes, args.steps)
+    elif args.build:
+        benchBuild(sizes)
+    elif args.memory:
+        benchMemory(sizes)
+    elif args.ticks:
+        benchTicks(sizes, args.tickCount, args.foes)
+    elif args.validate:
+        validateLevels(args.dataPath)
+    elif args.replay:
+        benchReplay(args.replay.split(","), args.dataPath)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
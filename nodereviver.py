@@ -45,6 +45,24 @@ def main():
     parser.add_option('--controls', action="store_true", default=config.controls,
                         dest='controls',
                         help='Displays UI buttons (suitable for touch screens)')
+    parser.add_option('--incremental-tracking', action="store_true", default=config.incrementalTracking,
+                        dest='incrementalTracking',
+                        help='tracking foes use incremental path finding')
+    parser.add_option('--scheduler-stats', action="store_true", default=config.schedulerStats,
+                        dest='schedulerStats',
+                        help='prints the number of late and dropped logic ticks on exit')
+    parser.add_option('--frame-stats', action="store_true", default=config.frameStats,
+                        dest='frameStats',
+                        help='shows the frame timing percentiles (toggle with F3)')
+    parser.add_option('--frame-stats-file', action="store", default=config.frameStatsFile,
+                        dest='frameStatsFile', type=str,
+                        help='writes the timings of the last frames to the given CSV file on exit')
+    parser.add_option('--profile', action="store_true", default=config.profile,
+                        dest='profile',
+                        help='writes a pstats file per game state and level (toggle with F4)')
+    parser.add_option('--record', action="store", default=config.recordFile,
+                        dest='recordFile', type=str,
+                        help='records the moves of every level attempt to the given file, for benchmark.py --replay')
     (args, rest) = parser.parse_args()
 
     config.startLevel = args.startLevel
@@ -52,6 +70,12 @@ def main():
     config.dataPath = args.dataPath
     config.fullScreen = args.fullScreen
     config.controls = args.controls
+    config.incrementalTracking = args.incrementalTracking
+    config.schedulerStats = args.schedulerStats
+    config.frameStats = args.frameStats
+    config.frameStatsFile = args.frameStatsFile
+    config.profile = args.profile
+    config.recordFile = args.recordFile
     if args.editor:
         from nodereviver.editor import Editor
         editor = Editor(config)
@@ -92,6 +92,7 @@ class WorldLoader(object):
         nodes = self._processNodes(world, nodesElement)
         self._processEdges(world, nodes, edgesElement)
         self._processEntities(world, nodes, entitiesElement)
+        world.buildNavigationTable()
 
         return world
 
@@ -115,6 +116,8 @@ class WorldSaver(object):
         edgesElement = ET.SubElement(root, "edges")
         entitiesElement = ET.SubElement(root, "entities")
 
+        # file ids, numbered from 1, by node
+        nodeIds = {}
         nodeId = 1
 
         for node in world.nodes:
@@ -125,19 +128,29 @@ class WorldSaver(object):
                     # ignore orphaned joints
                     continue
             ET.SubElement(nodesElement, tagName, {"id": str(nodeId), "x": str(node.pos[0]), "y": str(node.pos[1])})
-            node.id = nodeId
+            nodeIds[node] = nodeId
             nodeId += 1
+        if not nodeIds:
+            print "Warning: world %i has no nodes, not saved" % num
+            return
+        startNodeId = nodeIds.get(world.startNode)
+        if startNodeId == None:
+            print "Warning: start node %s was deleted, using the first node instead" % world.startNode
+            startNodeId = 1
         for edge in world.edges:
-            edgeElement = ET.SubElement(edgesElement, "edge", {"source": str(edge.source.id), "dest": str(edge.destination.id)})
+            edgeElement = ET.SubElement(edgesElement, "edge", {"source": str(nodeIds[edge.source]), "dest": str(nodeIds[edge.destination])})
             #if edge.reverse:
             #   edgeElement.set("reverse", "true")
             if edge.oneWay:
                 edgeElement.set("oneway", "true")
 
-        ET.SubElement(entitiesElement, "player", {"node": str(world.startNode.id)})
+        ET.SubElement(entitiesElement, "player", {"node": str(startNodeId)})
         for entity in world.entities:
             if entity.entityType == 1:
-                foeElement = ET.SubElement(entitiesElement, "foe", {"node": str(entity.currentNode.id)})
+                if entity.currentNode not in nodeIds:
+                    print "Warning: not saving foe standing on deleted node %s" % entity.currentNode
+                    continue
+                foeElement = ET.SubElement(entitiesElement, "foe", {"node": str(nodeIds[entity.currentNode])})
                 if entity.foeType == 0:
                     foeElement.set("type", "simple")
                 else:
@@ -87,6 +87,7 @@ class WorldLoader(object):
         nodes = self._processNodes(world, root["nodes"])
         self._processEdges(world, nodes, root["edges"])
         self._processEntities(world, nodes, root["entities"])
+        world.buildNavigationTable()
 
         return world
 
@@ -108,6 +109,8 @@ class WorldSaver(object):
         edgesElement = output["edges"] = []
         entitiesElement = output["entities"] = []
 
+        # file ids, numbered from 1, by node
+        nodeIds = {}
         nodeId = 1
 
         for node in world.nodes:
@@ -118,20 +121,30 @@ class WorldSaver(object):
                     # ignore orphaned joints
                     continue
             nodesElement.append({"id": nodeId, "type": nodeType, "x": str(node.pos[0]), "y": str(node.pos[1])})
-            node.id = nodeId
+            nodeIds[node] = nodeId
             nodeId += 1
+        if not nodeIds:
+            print "Warning: world %i has no nodes, not saved" % num
+            return
+        startNodeId = nodeIds.get(world.startNode)
+        if startNodeId == None:
+            print "Warning: start node %s was deleted, using the first node instead" % world.startNode
+            startNodeId = 1
         for edge in world.edges:
-            edgeElement = {"source": str(edge.source.id), "dest": str(edge.destination.id)}
+            edgeElement = {"source": str(nodeIds[edge.source]), "dest": str(nodeIds[edge.destination])}
             edgesElement.append(edgeElement)
             #if edge.reverse:
             #   edgeElement.set("reverse", "true")
             if edge.oneWay:
                 edgeElement["oneway"] = True
 
-        entitiesElement.append({"type": "player", "node": str(world.startNode.id)})
+        entitiesElement.append({"type": "player", "node": str(startNodeId)})
         for entity in world.entities:
             if entity.entityType == 1:
-                foeElement = {"type": "foe", "node": str(entity.currentNode.id)}
+                if entity.currentNode not in nodeIds:
+                    print "Warning: not saving foe standing on deleted node %s" % entity.currentNode
+                    continue
+                foeElement = {"type": "foe", "node": str(nodeIds[entity.currentNode])}
                 entitiesElement.append(foeElement)
                 if entity.foeType == 0:
                     foeElement["foeType"] = "simple"
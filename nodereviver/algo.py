@@ -16,95 +16,381 @@
 
     @author: Vincent Petry <PVince81@yahoo.fr>
 '''
+import heapq
+import threading
+import time
 import model
+from collections import OrderedDict
+from util import unitVector, vectorDiff
+
+class SearchStats(object):
+    '''
+    Counters of a path search, or the sum of several searches.
+    '''
+    def __init__(self):
+        self.queries = 0
+        # number of searches answered from the cache
+        self.cacheHits = 0
+        # number of nodes taken out of the open set
+        self.expansions = 0
+        # number of nodes added to the open set
+        self.pushes = 0
+        # length of the found path, None if no path was found
+        self.pathCost = None
+        # duration in seconds, without validation
+        self.wallTime = 0.0
+        # duration of the validation in seconds
+        self.validationTime = 0.0
+
+    def add(self, stats):
+        '''
+        Adds the counters of the given stats to these ones.
+        '''
+        self.queries += stats.queries
+        self.cacheHits += stats.cacheHits
+        self.expansions += stats.expansions
+        self.pushes += stats.pushes
+        self.pathCost = stats.pathCost
+        self.wallTime += stats.wallTime
+        self.validationTime += stats.validationTime
+
+    def __str__(self):
+        return "SearchStats{queries=%i,cacheHits=%i,expansions=%i,pushes=%i,pathCost=%s,wallTime=%.3fms}" % (self.queries, self.cacheHits, self.expansions, self.pushes, self.pathCost, self.wallTime * 1000.0)
 
 class PathFinder:
     '''
     A* path finding algorithm
+    The same instance can be used from several threads at the same time,
+    as every search works on its own per thread scratch arrays.
     '''
-    def __init__(self):
+    def __init__(self, cacheSize = 64, validate = False):
+        '''
+        @param cacheSize: maximum number of paths to keep in the LRU
+        cache, 0 disables the cache
+        @param validate: whether to check every result against
+        an exhaustive Dijkstra search (slow)
+        '''
         self.sourceNode = None
         self.goal = None
+        # Sum of the stats of all searches since creation
+        self.totalStats = SearchStats()
+        self.validate = validate
+        # Number of results which were not the shortest path
+        self.validationErrors = 0
+        self.cacheSize = cacheSize
+        # (start, goal) => (path, cost), least recently used first
+        self._cache = OrderedDict()
+        # world and revision of the world the cached paths belong to
+        self._cacheWorld = None
+        self._cacheRevision = None
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.cacheEvictions = 0
+        # protects the cache and counters
+        self._lock = threading.Lock()
+        self._local = threading.local()
 
     def h(self, source, target):
-        return abs(source.pos[0] - target.pos[0] + source.pos[1] - target.pos[1])
-
-    def lowest(self, list, scores):
-        min = 999999999999
-        curNode = None
-        for node in list:
-            score = scores[node]
-            if score < min:
-                curNode = node
-                min = score
-        return curNode
+        # Manhattan distance, which never overestimates since edges
+        # are either horizontal or vertical
+        return abs(source.pos[0] - target.pos[0]) + abs(source.pos[1] - target.pos[1])
 
-    def findShortestPath(self, start, goal):
+    def findShortestPath(self, start, goal, stats = None):
         '''
         Finds the shortest path from sourceNode to goal.
+        Results are cached until the world changes.
+        @param stats: optional SearchStats to fill with this search's counters
         @return: array of node's starting edges to follow to reach the target
         '''
+        if stats == None:
+            stats = SearchStats()
+        startTime = time.time()
+        stats.queries = 1
+
+        if self.cacheSize <= 0:
+            path, cost = self._findShortestPath(start, goal, stats)
+        else:
+            path, cost = self._findCachedShortestPath(start, goal, stats)
+
+        stats.pathCost = cost
+        stats.wallTime = time.time() - startTime - stats.validationTime
+        with self._lock:
+            self.totalStats.add(stats)
+
+        if path == None:
+            return None
+        return list(path)
+
+    def _findCachedShortestPath(self, start, goal, stats):
+        world = start.world
+        key = (start, goal)
+        with self._lock:
+            if world != self._cacheWorld or world.revision != self._cacheRevision:
+                self._clearCache()
+                self._cacheWorld = world
+                self._cacheRevision = world.revision
+            revision = self._cacheRevision
+            result = self._cache.pop(key, None)
+            if result:
+                self.cacheHits += 1
+                # reinsert as most recently used
+                self._cache[key] = result
+            else:
+                self.cacheMisses += 1
+
+        if result:
+            stats.cacheHits = 1
+            return result
+
+        # search outside of the lock so that other threads can run
+        path, cost = self._findShortestPath(start, goal, stats)
+        if path != None:
+            path = tuple(path)
+        with self._lock:
+            if world == self._cacheWorld and revision == self._cacheRevision:
+                self._cache[key] = (path, cost)
+                if len(self._cache) > self.cacheSize:
+                    self._cache.popitem(False)
+                    self.cacheEvictions += 1
+        return path, cost
+
+    def clearCache(self):
+        with self._lock:
+            self._clearCache()
+
+    def _clearCache(self):
+        self._cache.clear()
+        self._cacheWorld = None
+        self._cacheRevision = None
+
+    def getCacheStats(self):
+        '''
+        Returns the cache counters, to help sizing the cache.
+        @return: tuple (hits, misses, evictions)
+        '''
+        return (self.cacheHits, self.cacheMisses, self.cacheEvictions)
+
+    def _getScratch(self):
+        scratch = getattr(self._local, "scratch", None)
+        if not scratch or scratch.busy:
+            # first search on this thread or nested search
+            scratch = _SearchScratch()
+            if not getattr(self._local, "scratch", None):
+                self._local.scratch = scratch
+        return scratch
+
+    def _findShortestPath(self, start, goal, stats):
+        if goal.type == model.Node.JOINT:
+            # joints are not part of the contracted graph, so search
+            # edge by edge instead
+            getCorridors = self._getEdgeCorridors
+        else:
+            getCorridors = start.world.getNavigationGraph().getOutgoing
+
+        scratch = self._getScratch()
+        scratch.busy = True
+        try:
+            path, cost = self._search(scratch, start, goal, getCorridors, self.h, stats)
+            if self.validate:
+                validationStartTime = time.time()
+                self._validate(scratch, start, goal, getCorridors, cost)
+                stats.validationTime += time.time() - validationStartTime
+        finally:
+            scratch.busy = False
+        return path, cost
+
+    def _validate(self, scratch, start, goal, getCorridors, cost):
+        '''
+        Compares the cost of the found path with the one found by
+        an exhaustive Dijkstra search.
+        '''
+        path, expectedCost = self._search(scratch, start, goal, getCorridors, _zeroHeuristic, SearchStats())
+        if cost != expectedCost:
+            with self._lock:
+                self.validationErrors += 1
+            print "Warning: path from %s to %s has cost %s instead of %s" % (start, goal, cost, expectedCost)
+
+    def _search(self, scratch, start, goal, getCorridors, h, stats):
         # THANKS WIKIPEDIA!
-        closedset = set()
-        openset = set([start])
-        self.came_from = {}
+        # The open set is a binary heap of (f_score, counter, node) entries.
+        # Instead of a decrease-key, a better score pushes a new entry and
+        # the stale ones are skipped when popped (lazy deletion).
+        # Scores are kept in the scratch arrays indexed by node id, an entry
+        # only belongs to this search if its stamp matches.
+        scratch.prepare(start.world)
+        stamp = scratch.stamp
+        seen = scratch.seen
+        closed = scratch.closed
+        g_score = scratch.g
+        came_from = scratch.cameFrom
+        openheap = scratch.heap
+        del openheap[:]
+        counter = 0
+        expansions = 0
 
-        g_score = {}
-        h_score = {}
-        f_score = {}
         # Cost from start along best known path.
-        g_score[start] = 0
-        h_score[start] = self.h(start, goal)
-        # // Estimated total cost from start to goal through y.
-        f_score[start] = g_score[start] + h_score[start]
+        seen[start.id] = stamp
+        g_score[start.id] = 0
+        came_from[start.id] = None
+        heapq.heappush(openheap, (h(start, goal), counter, start))
 
-        while len(openset) > 0:
+        path = None
+        cost = None
+        while openheap:
             # the node in openset having the lowest f_score[] value
-            current = self.lowest(openset, f_score)
+            current = heapq.heappop(openheap)[2]
+            if closed[current.id] == stamp:
+                # stale entry
+                continue
             if current == goal:
-                return self.reconstruct_path(start, goal)
+                path = self._reconstructPath(came_from, start, goal)
+                cost = g_score[goal.id]
+                break
 
-            openset.remove(current)
-            closedset.add(current)
-            for edge in current.getOutgoingEdges():
-                neighbor = edge.getOther(current)
-                if neighbor in closedset:
+            closed[current.id] = stamp
+            expansions += 1
+            current_g_score = g_score[current.id]
+            for corridor in getCorridors(current):
+                neighbor = corridor.destination
+                neighborId = neighbor.id
+                if closed[neighborId] == stamp:
                     continue
-                tentative_g_score = g_score[current] + edge.length
-
-                if neighbor not in openset:
-                    openset.add(neighbor)
-                    h_score[neighbor] = self.h(neighbor, goal)
-                    tentative_is_better = True
-                elif tentative_g_score < g_score[neighbor]:
-                    tentative_is_better = True
+                tentative_g_score = current_g_score + corridor.length
+
+                if seen[neighborId] != stamp or tentative_g_score < g_score[neighborId]:
+                    seen[neighborId] = stamp
+                    came_from[neighborId] = corridor
+                    g_score[neighborId] = tentative_g_score
+                    counter += 1
+                    heapq.heappush(openheap, (tentative_g_score + h(neighbor, goal), counter, neighbor))
+
+        stats.expansions += expansions
+        stats.pushes += counter
+        return path, cost
+
+    def findPathsFrom(self, start, goals, stats = None):
+        '''
+        Finds the shortest paths from start to each of the given square
+        nodes with a single Dijkstra search.
+        @param stats: optional SearchStats to fill with this search's counters
+        @return: dict of goal => path, in the same format as
+        findShortestPath, None for unreachable goals
+        '''
+        graph = start.world.getNavigationGraph()
+        return self._findMultiplePaths(start, goals, graph.getOutgoing, True, stats)
+
+    def findPathsTo(self, starts, goal, stats = None):
+        '''
+        Finds the shortest paths from each of the given square nodes to goal
+        with a single reverse Dijkstra search.
+        @param stats: optional SearchStats to fill with this search's counters
+        @return: dict of start => path, in the same format as
+        findShortestPath, None for starts which can't reach goal
+        '''
+        graph = goal.world.getNavigationGraph()
+        return self._findMultiplePaths(goal, starts, graph.getIncoming, False, stats)
+
+    def _findMultiplePaths(self, origin, targets, getCorridors, forward, stats):
+        if stats == None:
+            stats = SearchStats()
+        startTime = time.time()
+        stats.queries = len(targets)
+
+        scratch = self._getScratch()
+        scratch.busy = True
+        try:
+            paths = self._multiSearch(scratch, origin, targets, getCorridors, forward, stats)
+        finally:
+            scratch.busy = False
+
+        stats.wallTime = time.time() - startTime
+        with self._lock:
+            self.totalStats.add(stats)
+        return paths
+
+    def _multiSearch(self, scratch, origin, targets, getCorridors, forward, stats):
+        '''
+        Dijkstra search from origin until all targets are reached.
+        In forward mode, corridors lead away from origin and paths go from
+        origin to the targets, otherwise corridors are followed backwards
+        and paths go from the targets to origin.
+        '''
+        scratch.prepare(origin.world)
+        stamp = scratch.stamp
+        seen = scratch.seen
+        closed = scratch.closed
+        g_score = scratch.g
+        came_from = scratch.cameFrom
+        openheap = scratch.heap
+        del openheap[:]
+        counter = 0
+        expansions = 0
+
+        remaining = set(targets)
+        seen[origin.id] = stamp
+        g_score[origin.id] = 0
+        came_from[origin.id] = None
+        heapq.heappush(openheap, (0, counter, origin))
+
+        while openheap and remaining:
+            current = heapq.heappop(openheap)[2]
+            if closed[current.id] == stamp:
+                # stale entry
+                continue
+            closed[current.id] = stamp
+            remaining.discard(current)
+            expansions += 1
+            current_g_score = g_score[current.id]
+            for corridor in getCorridors(current):
+                if forward:
+                    neighbor = corridor.destination
                 else:
-                    tentative_is_better = False
+                    neighbor = corridor.source
+                neighborId = neighbor.id
+                if closed[neighborId] == stamp:
+                    continue
+                tentative_g_score = current_g_score + corridor.length
+                if seen[neighborId] != stamp or tentative_g_score < g_score[neighborId]:
+                    seen[neighborId] = stamp
+                    came_from[neighborId] = corridor
+                    g_score[neighborId] = tentative_g_score
+                    counter += 1
+                    heapq.heappush(openheap, (tentative_g_score, counter, neighbor))
 
-                if tentative_is_better:
-                    self.came_from[neighbor] = edge
-                    g_score[neighbor] = tentative_g_score
-                    f_score[neighbor] = g_score[neighbor] + h_score[neighbor]
+        stats.expansions += expansions
+        stats.pushes += counter
 
-        return None
+        paths = {}
+        for target in targets:
+            if closed[target.id] != stamp:
+                paths[target] = None
+            elif forward:
+                paths[target] = self._reconstructPath(came_from, origin, target)
+            else:
+                path = []
+                node = target
+                while node != origin:
+                    corridor = came_from[node.id]
+                    path.append(corridor.edges[0])
+                    node = corridor.destination
+                paths[target] = path
+        return paths
 
-    def reconstruct_path(self, sourceNode, node):
+    def _getEdgeCorridors(self, node):
+        return [Corridor(node, [edge]) for edge in node.getOutgoingEdges()]
+
+    def _reconstructPath(self, came_from, sourceNode, node):
         path = []
-        while self.came_from.has_key(node):
-            edge = self.came_from[node]
-            path.append(edge)
-            node = edge.getOther(node)
+        corridor = came_from[node.id]
+        while node != sourceNode:
+            path.append(corridor)
+            node = corridor.source
+            corridor = came_from[node.id]
         path.reverse()
 
-        # remove joint nodes
-        finalEdges = []
-        node = sourceNode
-        for edge in path:
-            if node.type != model.Node.JOINT:
-                finalEdges.append(edge)
-            node = edge.getOther(node)
-
-        return finalEdges
+        # only keep the edges starting from square nodes, joints
+        # are walked through
+        return [corridor.edges[0] for corridor in path if corridor.source.type != model.Node.JOINT]
 
     def getPathNodes(self, sourceNode, edges):
         nodes = [sourceNode]
@@ -113,7 +399,7 @@ class PathFinder:
             nodes.append(node)
             print node
             print edge
-            node = edge.getOther(node)
+            node = node.getNextNode(edge)
         nodes.append(node)
         return nodes
 
@@ -122,5 +408,488 @@ class PathFinder:
         for edge in edges:
             print node
             print edge
-            node = edge.getOther(node)
+            node = node.getNextNode(edge)
         print node
+
+def _zeroHeuristic(source, target):
+    return 0
+
+class _SearchScratch(object):
+    '''
+    Per thread working arrays of PathFinder, indexed by node id and reused
+    from one search to the next. Instead of clearing them, every search
+    gets a new stamp and entries with an older stamp are ignored.
+    '''
+    def __init__(self):
+        self.busy = False
+        self.stamp = 0
+        # stamp of the search which last set g and cameFrom
+        self.seen = []
+        # stamp of the search which last closed the node
+        self.closed = []
+        self.g = []
+        self.cameFrom = []
+        self.heap = []
+
+    def prepare(self, world):
+        size = world.getMaxNodeId() + 1
+        missing = size - len(self.seen)
+        if missing > 0:
+            self.seen.extend([0] * missing)
+            self.closed.extend([0] * missing)
+            self.g.extend([0] * missing)
+            self.cameFrom.extend([None] * missing)
+        self.stamp += 1
+
+def _nodeId(node):
+    return node.id
+
+class IncrementalPathFinder:
+    '''
+    A* path finder for a moving goal which keeps its search tree between
+    calls and repairs it instead of searching from scratch.
+    Only works on the contracted navigation graph (square nodes).
+
+    When the goal changes, the open set is re-sorted for the new goal and
+    the search resumes: nothing needs to be searched if the new goal was
+    already expanded. When the open set is larger than what the last
+    search from scratch touched, searching again from scratch is cheaper
+    than re-sorting it. When the start moves along the previous path,
+    the subtree rooted at the new start is kept and its fringe becomes
+    the new open set.
+
+    Nodes are always pushed back in a fixed order (heap order or node id),
+    as the push order breaks ties between paths of equal cost: iterating
+    over sets of nodes would make the chosen path depend on memory
+    addresses and break replays.
+    '''
+    def __init__(self):
+        self._world = None
+        self._revision = None
+        self._start = None
+        self._goal = None
+        # node => cost from start
+        self._g = {}
+        # node => corridor leading to it in the search tree
+        self._cameFrom = {}
+        self._closed = set()
+        self._open = []
+        # goal the scores of the open set were computed for
+        self._openGoal = None
+        # number of nodes touched by the last search from scratch
+        self._freshTouched = 0
+        self._counter = 0
+        # Number of replans and of nodes expanded or pushed to the open set
+        self.replans = 0
+        self.touched = 0
+
+    def h(self, source, target):
+        # Manhattan distance, corridors can't be shorter than that
+        return abs(source.pos[0] - target.pos[0]) + abs(source.pos[1] - target.pos[1])
+
+    def findShortestPath(self, start, goal):
+        '''
+        Finds the shortest path from start to goal, reusing the previous
+        search when possible.
+        @return: array of node's starting edges to follow to reach the target
+        '''
+        self.replans += 1
+        touched = self.touched
+        fresh = False
+        world = start.world
+        if world != self._world or world.revision != self._revision:
+            self._reset(start, goal)
+            fresh = True
+        elif start != self._start:
+            if start in self._closed:
+                self._reroot(start)
+            else:
+                self._reset(start, goal)
+                fresh = True
+
+        self._goal = goal
+        if goal not in self._closed:
+            # the open set is only re-sorted when it has to be searched
+            if self._openGoal != goal:
+                if len(self._open) > self._freshTouched:
+                    self._reset(start, goal)
+                    fresh = True
+                else:
+                    self._rekey()
+            found = self._search()
+            if fresh:
+                self._freshTouched = self.touched - touched
+            if not found:
+                return None
+        return self._reconstructPath(goal)
+
+    def _reset(self, start, goal):
+        self._world = start.world
+        self._revision = start.world.revision
+        self._start = start
+        self._goal = goal
+        self._g = {start: 0}
+        self._cameFrom = {}
+        self._closed = set()
+        self._open = []
+        self._openGoal = goal
+        self._push(start, goal)
+
+    def _push(self, node, goal):
+        self._counter += 1
+        self.touched += 1
+        heapq.heappush(self._open, (self._g[node] + self.h(node, goal), self._counter, node))
+
+    def _rekey(self):
+        '''
+        Rebuilds the open set with the scores for the new goal.
+        '''
+        goal = self._goal
+        entries = self._open
+        self._open = []
+        self._openGoal = goal
+        seen = set()
+        for entry in entries:
+            node = entry[2]
+            if node in self._closed or node in seen:
+                continue
+            seen.add(node)
+            self._push(node, goal)
+
+    def _reroot(self, start):
+        '''
+        Keeps the search subtree starting at the new start node and
+        rebuilds the open set from its fringe.
+        '''
+        children = {}
+        for node, corridor in self._cameFrom.iteritems():
+            if node in self._closed:
+                children.setdefault(corridor.source, []).append(node)
+
+        offset = self._g[start]
+        g = {start: 0}
+        cameFrom = {}
+        closed = set([start])
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for child in children.get(node, []):
+                g[child] = self._g[child] - offset
+                cameFrom[child] = self._cameFrom[child]
+                closed.add(child)
+                stack.append(child)
+
+        # the fringe are the nodes reachable from the kept subtree
+        graph = self._world.getNavigationGraph()
+        for node in sorted(closed, key = _nodeId):
+            for corridor in graph.getOutgoing(node):
+                neighbor = corridor.destination
+                if neighbor in closed:
+                    continue
+                tentative = g[node] + corridor.length
+                if neighbor not in g or tentative < g[neighbor]:
+                    g[neighbor] = tentative
+                    cameFrom[neighbor] = corridor
+
+        self._start = start
+        self._g = g
+        self._cameFrom = cameFrom
+        self._closed = closed
+        self._open = []
+        self._openGoal = self._goal
+        for node in sorted(g, key = _nodeId):
+            if node not in closed:
+                self._push(node, self._goal)
+
+    def _search(self):
+        '''
+        Resumes the A* search until the goal is expanded.
+        @return: True if the goal was reached, False otherwise
+        '''
+        goal = self._goal
+        graph = self._world.getNavigationGraph()
+        g = self._g
+        closed = self._closed
+        while self._open:
+            current = heapq.heappop(self._open)[2]
+            if current in closed:
+                # stale entry
+                continue
+            # the goal gets expanded as well, to be able to resume later
+            closed.add(current)
+            self.touched += 1
+            for corridor in graph.getOutgoing(current):
+                neighbor = corridor.destination
+                if neighbor in closed:
+                    continue
+                tentative = g[current] + corridor.length
+                if neighbor not in g or tentative < g[neighbor]:
+                    g[neighbor] = tentative
+                    self._cameFrom[neighbor] = corridor
+                    self._push(neighbor, goal)
+            if current == goal:
+                return True
+        return False
+
+    def _reconstructPath(self, node):
+        path = []
+        while node != self._start:
+            corridor = self._cameFrom[node]
+            path.append(corridor.edges[0])
+            node = corridor.source
+        path.reverse()
+        return path
+
+class Corridor(object):
+    '''
+    Logical edge of the contracted navigation graph: a chain of edges
+    going from a node to the next square node through joint nodes.
+    '''
+    def __init__(self, source, edges):
+        self.source = source
+        # tuple of the edges in walking order
+        self.edges = tuple(edges)
+        # tuple of the visited nodes, starting with source
+        nodes = [source]
+        node = source
+        for edge in self.edges:
+            node = edge.getOther(node)
+            nodes.append(node)
+        self.nodes = tuple(nodes)
+        self.destination = node
+        self.length = 0
+        # movement direction along each edge
+        directions = []
+        traversable = True
+        for index in range(len(self.edges)):
+            edge = self.edges[index]
+            self.length += edge.length
+            directions.append(unitVector(vectorDiff(self.nodes[index + 1].pos, self.nodes[index].pos)))
+            if edge.oneWay and edge.source != self.nodes[index]:
+                traversable = False
+        self.directions = tuple(directions)
+        self.direction = self.directions[0]
+        # whether one way edges allow walking along this corridor
+        self.traversable = traversable
+
+    def getPolyline(self):
+        '''
+        Returns the positions of the nodes along the corridor.
+        '''
+        return [node.pos for node in self.nodes]
+
+    def __str__(self):
+        return "Corridor{src=%s,dst=%s,edges=%i,len=%i}" % (self.source.__str__(), self.destination.__str__(), len(self.edges), self.length)
+
+class NavigationGraph:
+    '''
+    Contracted graph of a world which only contains square nodes,
+    where every chain of joint nodes is replaced by a single corridor.
+    '''
+    def __init__(self):
+        # (node, first edge) => corridor
+        self._corridors = {}
+        # node => outgoing corridors
+        self._outgoing = {}
+        # node => incoming corridors
+        self._incoming = {}
+
+    def build(self, nodes):
+        self._corridors = {}
+        self._outgoing = {}
+        self._incoming = {}
+        squares = [node for node in nodes if node.type == model.Node.SQUARE]
+        for node in squares:
+            self._incoming.setdefault(node, [])
+        # follow the order of the nodes, not the one of the dictionary,
+        # so that searches break ties the same way on every run
+        for node in squares:
+            for corridor in self.getOutgoing(node):
+                self._incoming.setdefault(corridor.destination, []).append(corridor)
+
+    def getCorridor(self, node, edge):
+        '''
+        Returns the corridor starting at the given node along the given
+        edge, regardless of its traversability.
+        '''
+        key = (node, edge)
+        corridor = self._corridors.get(key)
+        if not corridor:
+            edges = [edge]
+            nextNode = edge.getOther(node)
+            while nextNode.type == model.Node.JOINT and nextNode != node:
+                edge = nextNode.getOtherEdge(edge)
+                if not edge:
+                    # dead end
+                    break
+                edges.append(edge)
+                nextNode = edge.getOther(nextNode)
+            corridor = Corridor(node, edges)
+            self._corridors[key] = corridor
+        return corridor
+
+    def getOutgoing(self, node):
+        '''
+        Returns the corridors that can be walked from the given node.
+        '''
+        corridors = self._outgoing.get(node)
+        if corridors is None:
+            corridors = []
+            for edge in node.edges:
+                corridor = self.getCorridor(node, edge)
+                if corridor.traversable:
+                    corridors.append(corridor)
+            self._outgoing[node] = corridors
+        return corridors
+
+    def getIncoming(self, node):
+        '''
+        Returns the traversable corridors between square nodes
+        which end at the given node.
+        '''
+        return self._incoming.get(node, [])
+
+class FlowField:
+    '''
+    Distance of every node to a single target node along with the next
+    corridor to follow to get closer, computed with a reverse Dijkstra
+    over the incoming corridors. It can be shared by all the entities
+    heading to the same target.
+
+    The search is lazy: it only runs until the queried node is settled
+    and is resumed for nodes further away, so that a target change only
+    costs the region containing the entities asking for a path instead
+    of the whole graph. Results are the same as with a complete search.
+    '''
+    def __init__(self, graph, target, complete = False):
+        '''
+        @param graph: contracted navigation graph of the world
+        @param target: target node
+        @param complete: whether to search the whole graph right away
+        '''
+        self.target = target
+        self._graph = graph
+        # node => distance to target, final for settled nodes
+        self.distances = {target: 0}
+        # node => next corridor
+        self._nextCorridors = {}
+        self._closed = set()
+        self._open = [(0, 0, target)]
+        self._counter = 0
+        if complete:
+            self._settle(None)
+
+    def _settle(self, node):
+        '''
+        Resumes the search until the given node is settled, or until the
+        whole graph is searched if node is None.
+        @return: True if the node is settled, False if it is not reachable
+        '''
+        closed = self._closed
+        if node in closed:
+            return True
+        distances = self.distances
+        nextCorridors = self._nextCorridors
+        openheap = self._open
+        graph = self._graph
+        while openheap:
+            distance, ignore, current = heapq.heappop(openheap)
+            if current in closed:
+                continue
+            closed.add(current)
+            # follow the incoming corridors backwards
+            for corridor in graph.getIncoming(current):
+                neighbor = corridor.source
+                tentativeDistance = distance + corridor.length
+                if neighbor not in distances or tentativeDistance < distances[neighbor]:
+                    distances[neighbor] = tentativeDistance
+                    nextCorridors[neighbor] = corridor
+                    self._counter += 1
+                    heapq.heappush(openheap, (tentativeDistance, self._counter, neighbor))
+            if current == node:
+                return True
+        # nothing more to search, drop the graph
+        self._graph = None
+        return node in closed
+
+    def getDistance(self, node):
+        '''
+        Returns the distance from node to the target
+        or None if the target is not reachable.
+        '''
+        if not self._settle(node):
+            return None
+        return self.distances.get(node)
+
+    def getNextEdge(self, node):
+        '''
+        Returns the edge to follow from node to reach the target
+        or None if the target is not reachable.
+        '''
+        if not self._settle(node):
+            return None
+        corridor = self._nextCorridors.get(node)
+        if not corridor:
+            return None
+        return corridor.edges[0]
+
+    def getPath(self, start):
+        '''
+        Returns the path from start to the target in the same format as
+        PathFinder.findShortestPath or None if it is not reachable.
+        '''
+        # the nodes on the way are closer to the target, so settled as well
+        if not self._settle(start):
+            return None
+        nextCorridors = self._nextCorridors
+        path = []
+        node = start
+        while node != self.target:
+            corridor = nextCorridors.get(node)
+            if not corridor:
+                return None
+            path.append(corridor.edges[0])
+            node = corridor.destination
+        return path
+
+class NavigationTable:
+    '''
+    Precomputed next hop table between all square nodes of a world.
+    For every target square node, maps each square node to the outgoing
+    edge to follow to reach that target, honoring one way edges.
+    '''
+    def __init__(self):
+        # target node => flow field
+        self._flowFields = {}
+
+    def build(self, graph, nodes):
+        '''
+        Builds the table by computing the flow field of every
+        square node.
+        @param graph: contracted navigation graph of the world
+        @param nodes: nodes of the world
+        '''
+        self._flowFields = {}
+        for target in nodes:
+            if target.type == model.Node.SQUARE:
+                self._flowFields[target] = FlowField(graph, target, True)
+
+    def hasTarget(self, target):
+        return target in self._flowFields
+
+    def getFlowField(self, target):
+        return self._flowFields[target]
+
+    def getNextEdge(self, node, target):
+        '''
+        Returns the edge to follow from node to reach target
+        or None if target is not reachable.
+        '''
+        return self._flowFields[target].getNextEdge(node)
+
+    def getPath(self, start, goal):
+        '''
+        Returns the path from start to goal in the same format as
+        PathFinder.findShortestPath or None if goal is not reachable.
+        '''
+        return self._flowFields[goal].getPath(start)
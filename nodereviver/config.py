@@ -28,6 +28,8 @@ class KeyMap:
         self.directions = [self.up, self.down, self.left, self.right]
         self.start = [pygame.locals.K_RETURN, pygame.locals.K_KP_ENTER]
         self.quit = [pygame.locals.K_ESCAPE, pygame.locals.K_BACKSPACE]
+        self.profiler = [pygame.locals.K_F3]
+        self.profileCapture = [pygame.locals.K_F4]
 
 class Config:
     def __init__(self):
@@ -44,3 +46,25 @@ class Config:
         self.controls = False
         # Number of particles to generate (0.5 half, 2.0 twice more)
         self.particlesRatio = 1.0
+        # Tracking foes repair their previous search instead of using
+        # the shared flow field
+        self.incrementalTracking = False
+        # Maximum number of logic ticks run in one frame to catch up
+        # after a slow frame, the rest is dropped
+        self.maxCatchUpTicks = 5
+        # Print the scheduler statistics (late and dropped ticks) on exit
+        self.schedulerStats = False
+        # Maximum time in milliseconds to wait for input when paused or
+        # in menus, before checking the game state again
+        self.idleTimeout = 250
+        # Show the frame timings overlay (toggled with F3)
+        self.frameStats = False
+        # File to write the frame timings to on exit, as CSV
+        self.frameStatsFile = None
+        # Number of frames kept by the frame profiler
+        self.profilerFrames = 3600
+        # Capture a cProfile profile per game state and level from the
+        # start (toggled with F4)
+        self.profile = False
+        # File to record the player moves of every level attempt to
+        self.recordFile = None
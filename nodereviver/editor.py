@@ -21,6 +21,7 @@ from WorldLoaderJson import WorldSaver
 import pygame
 import view
 import model
+import sound
 from config import Config
 from model import GameState
 from algo import PathFinder
@@ -31,6 +32,10 @@ class Editor(Game):
         self._selectedNodes = []
         self._selectedEdge = None
         self._config.cheat = True
+        if self._config.recordFile:
+            # replays load the saved level, not the one being edited
+            print "Warning: level attempts are not recorded in the editor"
+            self._config.recordFile = None
         self._worldSaver = WorldSaver(self._config.dataPath)
 
     def _init(self):
@@ -125,12 +130,12 @@ class Editor(Game):
             if event.key == pygame.locals.K_t:
                 # Toggle type
                 if self._selectedEdge:
-                    self._selectedEdge.oneWay = not self._selectedEdge.oneWay
+                    self._selectedEdge.setOneWay(not self._selectedEdge.oneWay)
                 for node in self._selectedNodes:
                     if node.type == model.Node.JOINT:
-                        node.type = model.Node.SQUARE
+                        node.setType(model.Node.SQUARE)
                     else:
-                        node.type = model.Node.JOINT
+                        node.setType(model.Node.JOINT)
                 self._world.dirty = True
             if event.key == pygame.locals.K_p:
                 if len(self._selectedNodes) > 0:
@@ -139,20 +144,40 @@ class Editor(Game):
             elif event.key == pygame.locals.K_F2:
                 self._saveWorld()
             elif event.key == pygame.locals.K_F5:
-                # TODO: need to clone the current level instead of reloading!
-                self._startGame(self._gameState.worldNum)
+                self._playLevel()
             elif event.key == pygame.locals.K_x:
                 self._testPathFinder()
 
+    def _playLevel(self):
+        '''
+        Plays the level as currently edited, restarts and going back to
+        the editor restore it from a snapshot.
+        '''
+        self._worldSnapshot = self._world.snapshot()
+        self._gameState.setState(GameState.LEVEL_START, 1000)
+        self._restartWorld()
+        sound.soundManager.enable()
+
     def _testPathFinder(self):
         if len(self._selectedNodes) == 0:
             return
         # Test the pathfinding algo from player to selection
         pathfinder = PathFinder()
-        print "Path finder from %i to %i" % (self._player.currentNode.id, self._selectedNodes[0].id )
-        path = pathfinder.findShortestPath(self._player.currentNode, self._selectedNodes[0])
-        pathfinder.printPath(self._player.currentNode, path)
-        self._selectedNodes = pathfinder.getPathNodes(self._player.currentNode, path)
+        startNode = self._player.currentNode
+        if len(self._selectedNodes) > 1:
+            # one search for all selected nodes
+            print "Path finder from %i to %s" % (startNode.id, [node.id for node in self._selectedNodes])
+            paths = pathfinder.findPathsFrom(startNode, self._selectedNodes)
+            selection = []
+            for node in self._selectedNodes:
+                if paths[node] != None:
+                    selection += pathfinder.getPathNodes(startNode, paths[node])
+        else:
+            print "Path finder from %i to %i" % (startNode.id, self._selectedNodes[0].id )
+            path = pathfinder.findShortestPath(startNode, self._selectedNodes[0])
+            pathfinder.printPath(startNode, path)
+            selection = pathfinder.getPathNodes(startNode, path)
+        self._selectedNodes = selection
         self._display.selectionView.setSelection(self._selectedNodes)
 
     def _handleLogic(self):
@@ -163,23 +188,38 @@ class Editor(Game):
     def onLevelEnd(self):
         self._gameState.setState(GameState.LEVEL_END, self._config.fps, GameState.RESTART_LEVEL);
 
+    def _isIdle(self):
+        # the edited level only changes on input
+        return self._gameState.state == GameState.EDITOR or Game._isIdle(self)
+
     def onBack(self):
         if self._gameState.state == GameState.EDITOR:
             self._terminated = True
         else:
             self._gameState.setState(GameState.EDITOR)
+            # remove the marks and foe moves of the play session
+            self._restartWorld()
 
     def run(self):
         self._init()
         self._gameState.state = model.GameState.EDITOR
         self._initWorld(self._gameState.worldNum)
 
+        if self._config.profile:
+            self._stateProfiler.start()
+
+        stateProfiler = self._stateProfiler
         while not self._terminated:
+            stateProfiler.update()
             self._handleInput()
             self._handleLogic()
-            self._display.render()
-            pygame.display.flip()
-            self._clock.tick(self._config.fps)
+            stateProfiler.update()
+            if self._display.render():
+                pygame.display.flip()
+            if self._isIdle():
+                self._waitForInput(self._config.idleTimeout)
+            else:
+                self._clock.tick(self._config.fps)
 
         self._quit()
 
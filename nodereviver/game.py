@@ -21,15 +21,20 @@ import model
 import view
 import sound
 import time
+import random
 import ui
 from util import *
+from scheduler import Scheduler
+from profiler import FrameProfiler, StateProfiler
+from replay import InputScript, InputReplay, loadScripts, saveScripts
 from config import Config
 from WorldLoaderJson import WorldLoader
 from model import GameState
 
-class Game:
-    titleDemo = [3,0,0,3,0,1,2,1,1,3,0,2,0,3,1,2,1,3,0,2,0,3,1,2,1,3,0,2,0,0,3,2,1,3,2,1,3,3,2,1,3,1,2,2,2,2,2,2,2,1,2,1,1,0,3,1,2,3,0,2,0,3,1,2,1,1,3,2,0,3,2,0,3,3,2,0,3,1,1,3,3,3,0,0,1,2,2,0,0,0,3,1,1,2,3,3,2,0,2,3,3,2,0,3,1,1,3,3,0,0,1,2,2,0,0,0,3,1,3,2,2,1,3,2,1,3,2,0,0,3,0,3,1,2,1,1,0,0,3,3,1,2,2,3,1,1,2]
+# posted to wake up the main loop when waiting for input
+WAKEUP_EVENT = pygame.USEREVENT
 
+class Game:
     def __init__(self, config):
         self._config = config
         if self._config.dataPath[-1] != '/':
@@ -41,8 +46,17 @@ class Game:
         self._terminated = False
         self._display = None
         self._world = None
+        self._worldSnapshot = None
         self._gameState = model.GameState()
         self._player = None
+        self._profiler = None
+        self._stateProfiler = StateProfiler(self._gameState)
+        # input script played on the title screen
+        self._titleDemo = None
+        self._demoReplay = None
+        # attempts recorded for --record and the one in progress
+        self._scripts = []
+        self._script = None
         self._worldLoader = WorldLoader(self._config.dataPath)
 
     def _init(self):
@@ -53,6 +67,8 @@ class Game:
         pygame.mouse.set_visible(False)
         self._screen = pygame.display.get_surface()
         self._clock = pygame.time.Clock()
+        # the logic always runs at 60 ticks per second
+        self._scheduler = Scheduler(60, self._config.maxCatchUpTicks, pygame.time.get_ticks)
         self._display = view.Display(self._config, self._screen, self._gameState)
 
         if self._config.controls:
@@ -61,8 +77,20 @@ class Game:
             self._gameUI = None
 
         sound.soundManager.loadSounds()
+        self._titleDemo = loadScripts(self._config.dataPath + "titledemo.json")[0]
 
     def _quit(self):
+        if self._config.recordFile:
+            self._finishRecording()
+            saveScripts(self._config.recordFile, self._scripts)
+            print "Recorded %i attempts to %s" % (len(self._scripts), self._config.recordFile)
+        if self._stateProfiler.enabled:
+            self._stopProfiling()
+        if self._config.schedulerStats:
+            print "Scheduler: %s" % self._scheduler
+        if self._config.frameStatsFile and self._profiler:
+            self._profiler.saveCsv(self._config.frameStatsFile)
+            print "Frame timings written to %s" % self._config.frameStatsFile
         sound.soundManager.release()
         pygame.quit()
 
@@ -74,15 +102,8 @@ class Game:
         pygame.display.set_mode(self._config.screenSize, flags)
 
     def _movePlayer(self, direction):
-        if self._player.moving:
-            return
-
-        movements = [(0, -1), (0, 1), (-1, 0), (1, 0)]
-        movement = movements[direction]
-        # Check whether player is allowed to move to this direction
-        edge = self._player.currentNode.getEdgeByDirection(movement)
-        if edge:
-            self._player.moveAlong(edge)
+        if self._player.moveTowards(direction) and self._script:
+            self._script.record(self._world.ticks, direction)
 
     def _handleInputEvent(self, event):
         action = None
@@ -96,6 +117,10 @@ class Game:
         elif event.type == pygame.locals.KEYDOWN:
             if event.key in self._config.keymap.pause:
                 action = "togglepause"
+            elif event.key in self._config.keymap.profiler:
+                action = "toggleprofiler"
+            elif event.key in self._config.keymap.profileCapture:
+                action = "toggleprofiling"
             elif event.key in self._config.keymap.start:
                 mods = pygame.key.get_mods()
                 if mods & pygame.locals.KMOD_ALT:
@@ -136,6 +161,16 @@ class Game:
         elif action == "togglepause":
             if self._gameState.state == GameState.GAME:
                 self._gameState.pause = not self._gameState.pause
+        elif action == "toggleprofiler":
+            if self._profiler:
+                self._config.frameStats = not self._config.frameStats
+                self._showFrameStats()
+        elif action == "toggleprofiling":
+            if self._stateProfiler.enabled:
+                self._stopProfiling()
+            else:
+                print "Profiling started"
+                self._stateProfiler.start()
         elif action == "togglefullscreen":
             self._config.fullScreen = not self._config.fullScreen
             self._initDisplay()
@@ -158,21 +193,55 @@ class Game:
         else:
             self._startTitle()
 
+    def _showFrameStats(self):
+        if self._config.frameStats:
+            self._display.setProfiler(self._profiler)
+        else:
+            self._display.setProfiler(None)
+
+    def _stopProfiling(self):
+        fileNames = self._stateProfiler.stop()
+        print "Profiling stopped, written %s" % ", ".join(fileNames)
+
     def _taskSwitch(self):
         # TODO: trigger task switching, if supported
         pass
 
     def _handleInput(self):
         for event in pygame.event.get():
+            if event.type == WAKEUP_EVENT:
+                # fired by _waitForInput's timer, nothing changed
+                continue
+            # any event (key, focus, expose...) can change the screen
+            self._display.invalidate()
             self._handleInputEvent(event)
 
-    def _handleDemo(self):
-        if self._player.moving:
-            return
+    def _isIdle(self):
+        '''
+        Returns whether nothing will happen until the next input event.
+        '''
+        state = self._gameState
+        return not state.focus or state.pause or self._display.isIdle()
+
+    def _waitForInput(self, timeout):
+        '''
+        Blocks until an input event arrives, instead of rendering
+        frames that would all look the same.
+        @param timeout: maximum time to wait in milliseconds
+        '''
+        # pygame.event.wait() has no timeout, so use a timer to wake up
+        pygame.time.set_timer(WAKEUP_EVENT, timeout)
+        event = pygame.event.wait()
+        pygame.time.set_timer(WAKEUP_EVENT, 0)
+        # the timer may have fired again before being stopped
+        pygame.event.clear(WAKEUP_EVENT)
+        if event.type != WAKEUP_EVENT:
+            self._display.invalidate()
+            self._handleInputEvent(event)
 
-        nextDirection = self._titleDemo[0]
-        self._titleDemo = self._titleDemo[1:]
-        self._movePlayer(nextDirection)
+    def _handleDemo(self):
+        for direction in self._demoReplay.getMoves(self._world.ticks):
+            self._movePlayer(direction)
 
     def _handleLogic(self):
         state = self._gameState
@@ -184,7 +253,10 @@ class Game:
                     state.setState(GameState.ENDGAME)
                     return;
             state.dirty = True
-            self._initWorld(state.worldNum)
+            if state.state == GameState.RESTART_LEVEL and self._worldSnapshot:
+                self._restartWorld()
+            else:
+                self._initWorld(state.worldNum)
             state.setState(GameState.LEVEL_START, 1000)
 
         if state.state == GameState.TITLE:
@@ -197,26 +269,34 @@ class Game:
         self._gameState.elapsed += 60
 
         if state.state in [GameState.GAME, GameState.TITLE, GameState.LEVEL_END, GameState.LEVEL_START]:
+            if state.state == GameState.GAME and self._script and self._script.startTick == None:
+                self._script.startTick = self._world.ticks
             self._world.update()
+            self._handleWorldEvents()
 
         if state.state in [GameState.GAME, GameState.TITLE] and self._world.hasAllEdgesMarked():
             self.onLevelEnd()
 
         if state.state == GameState.GAME:
             # check for player collision
-            for entity in self._world.entities:
-                if entity == self._player:
-                    continue
-                dist = vectorDiff(entity.pos, self._player.pos)
-                if abs(dist[0]) < 10 and abs(dist[1]) < 10:
-                    self._player.die()
-                    state.setState(GameState.DEAD, 1000, GameState.RESTART_LEVEL)
-                    sound.soundManager.play(sound.soundManager.DEAD)
+            if self._world.getCollisions(self._player):
+                self._player.die()
+                self._finishRecording(InputScript.DEAD)
+                state.setState(GameState.DEAD, 1000, GameState.RESTART_LEVEL)
+                sound.soundManager.play(sound.soundManager.DEAD)
+
+    def _handleWorldEvents(self):
+        for event in self._world.events:
+            if event.type == model.GameEvent.NODES_MARKED:
+                sound.soundManager.play(sound.soundManager.DRAW)
+            elif event.type == model.GameEvent.PLAYER_STOPPED:
+                sound.soundManager.play(sound.soundManager.MOVE)
 
     def onLevelEnd(self):
         if self._gameState.state == GameState.TITLE:
             self._startTitle()
             return
+        self._finishRecording(InputScript.COMPLETED)
         self._gameState.setState(GameState.LEVEL_END, 1000, GameState.NEXT_LEVEL)
 
     def _showStory(self):
@@ -239,15 +319,28 @@ class Game:
         self._gameState.state = GameState.QUIT
 
     def _initWorld(self, worldNum):
-        self._player = model.Player()
+        self._finishRecording()
         if self._gameState.state == GameState.TITLE:
-            self._player.speed = 4
             self._world = self._worldLoader.loadWorld(0)
-            self._titleDemo = list(self.titleDemo)
+            self._demoReplay = InputReplay(self._titleDemo)
             sound.soundManager.enable(False)
         else:
             self._world = self._worldLoader.loadWorld(worldNum)
         self._world.centerInView(self._display.context.boardSize)
+        # to restart the level without reloading it
+        self._worldSnapshot = self._world.snapshot()
+        self._setupWorld()
+
+    def _restartWorld(self):
+        '''
+        Resets the current world to its last snapshot.
+        '''
+        self._finishRecording()
+        self._world.restore(self._worldSnapshot)
+        self._setupWorld()
+
+    def _setupWorld(self):
+        self._player = model.Player()
         self._player.setCurrentNode(self._world.startNode)
         if self._gameUI:
             if self._gameState.state in [GameState.LEVEL_START, GameState.NEXT_LEVEL, GameState.RESTART_LEVEL]:
@@ -258,40 +351,81 @@ class Game:
         self._display.setWorld(self._world, self._player)
         self._world.addEntity(self._player)
 
+        if self._gameState.state == GameState.TITLE:
+            self._player.speed = self._titleDemo.playerSpeed
+            seed = self._titleDemo.seed
+        else:
+            # a new seed for each attempt, recorded to replay it
+            seed = random.randint(0, 0x7fffffff)
+            if self._config.recordFile:
+                self._startRecording(seed)
+        self._world.random.seed(seed)
+
         # set tracking foes to track the player
         for entity in self._world.entities:
             if entity.entityType == 1 and entity.foeType == 1:
                 entity.track(self._player)
+                if self._config.incrementalTracking:
+                    entity.setStrategy(model.TrackingFoe.STRATEGY_INCREMENTAL)
+
+    def _startRecording(self, seed):
+        self._script = InputScript(self._gameState.worldNum, seed)
+        self._script.playerSpeed = self._player.speed
+        self._script.incrementalTracking = self._config.incrementalTracking
+        self._scripts.append(self._script)
+
+    def _finishRecording(self, result = None):
+        '''
+        Ends the recording of the current attempt, if any.
+        @param result: InputScript.COMPLETED, DEAD or None if interrupted
+        '''
+        if self._script:
+            self._script.finish(result, self._world.ticks)
+            self._script = None
 
     def run(self):
         self._init()
         self._gameState.state = GameState.TITLE
         self._initWorld(self._gameState.worldNum)
 
-        lastTime = pygame.time.get_ticks()
-        deltaTime = 0
-        # desired fps is 60
-        fpsMax = 1000 / 60
+        self._profiler = FrameProfiler(self._config.profilerFrames)
+        self._showFrameStats()
+
+        if self._config.profile:
+            self._stateProfiler.start()
+
+        scheduler = self._scheduler
+        profiler = self._profiler
+        stateProfiler = self._stateProfiler
         while not self._terminated:
+            profiler.beginFrame()
+            stateProfiler.update()
             self._handleInput()
+            profiler.mark(FrameProfiler.INPUT)
             if self._gameState.focus:
-                # frameskip
-                newTime = pygame.time.get_ticks()
-                deltaTime = deltaTime + pygame.time.get_ticks() - lastTime
-                updateSteps = deltaTime / fpsMax
-                for x in range(updateSteps):
+                for x in range(scheduler.advance()):
                     self._handleLogic()
-
-                deltaTime = deltaTime % fpsMax
-                lastTime = newTime
-
-                if not self._gameState.pause:
-                    for x in range(updateSteps):
+                    stateProfiler.update()
+                    profiler.mark(FrameProfiler.LOGIC)
+                    if not self._gameState.pause:
                         self._display.update()
-                    self._display.render()
-                    pygame.display.flip()
+                        profiler.mark(FrameProfiler.UPDATE)
 
-            self._clock.tick(self._config.fps)
+                if not self._gameState.pause:
+                    rendered = self._display.render(scheduler.getInterpolation())
+                    profiler.mark(FrameProfiler.RENDER)
+                    if rendered:
+                        pygame.display.flip()
+                        profiler.mark(FrameProfiler.FLIP)
+
+            if self._isIdle():
+                self._waitForInput(self._config.idleTimeout)
+                # don't catch up the time spent waiting
+                scheduler.reset()
+            else:
+                self._clock.tick(self._config.fps)
+            profiler.mark(FrameProfiler.WAIT)
+            profiler.endFrame()
 
         self._quit()
 
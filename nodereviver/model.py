@@ -17,21 +17,26 @@
     @author: Vincent Petry <PVince81@yahoo.fr>
 '''
 import random
-import sound
 from util import *
-from algo import PathFinder
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from algo import IncrementalPathFinder, NavigationGraph, NavigationTable, FlowField
 
-pathFinder = PathFinder()
+# direction vector => slot in Node's direction table
+_directionSlots = {(0, -1): 0, (0, 1): 1, (-1, 0): 2, (1, 0): 3}
 
-_nextNodeId = 1
 class Node(object):
     SQUARE = 0
     JOINT = 1
 
+    # no per instance dictionary, generated worlds can have many nodes
+    __slots__ = ("id", "world", "type", "pos", "deleted", "marked", "edges",
+                 "_unmarkedEdges", "_directionEdges", "_outgoingEdges")
+
     def __init__(self, world, pos = (0, 0), nodeType = SQUARE):
-        global _nextNodeId
-        self.id = _nextNodeId
-        _nextNodeId += 1
+        self.id = world._allocateNodeId()
         self.world = world
         self.type = nodeType
         self.pos = pos
@@ -39,23 +44,73 @@ class Node(object):
         self.marked = False
         # Edges are saved in this order: up, down, left, right
         self.edges = []
+        # number of edges in self.edges which are not marked yet
+        self._unmarkedEdges = 0
+        # outgoing edge by direction slot (up, down, left, right) and
+        # tuple of outgoing edges, rebuilt when the edges change
+        self._directionEdges = None
+        self._outgoingEdges = None
 
     def connect(self, otherNode, oneWay = False):
         '''
         Connects the current node to the other node
         and returns the generated edge
         '''
-        for edge in self.edges:
-            if edge.getOther(self) == otherNode:
-                print "Warning: node %s already connected to %s through %s" % (self, otherNode, edge)
-                return None
+        edge = self.world.getEdgeBetween(self, otherNode)
+        if edge:
+            print "Warning: node %s already connected to %s through %s" % (self, otherNode, edge)
+            return None
         edge = Edge(self.world, self, otherNode, oneWay)
         self.edges.append(edge)
         otherNode.edges.append(edge)
+        self._unmarkedEdges += 1
+        otherNode._unmarkedEdges += 1
+        self.onEdgesChanged()
+        otherNode.onEdgesChanged()
         return edge
 
+    def onEdgesChanged(self):
+        '''
+        Must be called whenever an edge is added to or removed from this
+        node, changes direction or changes its one way flag.
+        '''
+        self._directionEdges = None
+        self._outgoingEdges = None
+
+    def _buildEdgeCache(self):
+        directionEdges = [None, None, None, None]
+        outgoingEdges = []
+        for edge in self.edges:
+            # skip oneway incoming edges
+            if edge.oneWay and edge.destination == self:
+                continue
+            outgoingEdges.append(edge)
+            destNode = edge.getOther(self)
+            slot = _directionSlots.get(unitVector(vectorDiff(destNode.pos, self.pos)))
+            # the first edge found in a direction wins
+            if slot != None and not directionEdges[slot]:
+                directionEdges[slot] = edge
+        self._directionEdges = tuple(directionEdges)
+        self._outgoingEdges = tuple(outgoingEdges)
+
+    def setType(self, nodeType):
+        if nodeType == self.type:
+            return
+        self.world._setNodeMarked(self, False)
+        self.type = nodeType
+        self.world.journal.record(ChangeJournal.UPDATED, self)
+        if nodeType == Node.SQUARE:
+            self.world._updateNodeMarked(self)
+        # joints are contracted in the navigation graph
+        self.world.onTopologyChanged()
+
     def getOutgoingEdges(self):
-        return [edge for edge in self.edges if not edge.oneWay or edge.source == self]
+        '''
+        Returns the tuple of the edges that can be followed from this node.
+        '''
+        if self._outgoingEdges == None:
+            self._buildEdgeCache()
+        return self._outgoingEdges
 
     def getOutgoingNeighbours(self):
         edges = self.getOutgoingEdges()
@@ -70,15 +125,12 @@ class Node(object):
         or None if none found.
         @param direction: direction vector
         '''
-        for edge in self.edges:
-            # skip oneway incoming edges
-            if edge.oneWay and edge.destination == self:
-                continue
-            destNode = edge.getOther(self)
-            diff = unitVector(vectorDiff(destNode.pos, self.pos))
-            if direction == diff:
-                return edge
-        return None
+        slot = _directionSlots.get(direction)
+        if slot == None:
+            return None
+        if self._directionEdges == None:
+            self._buildEdgeCache()
+        return self._directionEdges[slot]
 
     def getOtherEdge(self, sourceEdge):
         for edge in self.edges:
@@ -91,11 +143,7 @@ class Node(object):
         Returns the next node following the path along the given edge.
         @param edge edge to use as direction
         '''
-        nextNode = edge.getOther(self)
-        while nextNode.type == Node.JOINT and nextNode != self:
-            nextNode = nextNode.getNextNode(nextNode.getOtherEdge(edge))
-
-        return nextNode
+        return self.world.getNavigationGraph().getCorridor(self, edge).destination
 
     def __str__(self):
         typeString = "S"
@@ -103,12 +151,12 @@ class Node(object):
             typeString = "J"
         return "Node{id=%i,pos=%s,type=%s}" % (self.id, self.pos.__str__(), typeString)
 
-_nextEdgeId = 1
 class Edge(object):
+    __slots__ = ("id", "world", "source", "destination", "oneWay", "marked",
+                 "markedLength", "deleted", "length")
+
     def __init__(self, world, source, destination, oneWay = False):
-        global _nextEdgeId
-        self.id = _nextEdgeId
-        _nextEdgeId += 1
+        self.id = world._allocateEdgeId()
         self.world = world
         self.source = source
         self.destination = destination
@@ -128,37 +176,344 @@ class Edge(object):
         return self.source
 
     def reverse(self):
+        self.world._removeEdgeKey(self)
         aux = self.source
         self.source = self.destination
         self.destination = aux
+        self.world._addEdgeKey(self)
+        self.source.onEdgesChanged()
+        self.destination.onEdgesChanged()
+        self.world.journal.record(ChangeJournal.REVERSED, self)
+        self.world.onTopologyChanged()
+
+    def setOneWay(self, oneWay):
+        self.oneWay = oneWay
+        self.source.onEdgesChanged()
+        self.destination.onEdgesChanged()
+        self.world.journal.record(ChangeJournal.UPDATED, self)
+        self.world.onTopologyChanged()
 
     def isMarked(self):
         return self.marked
 
     def setMarked(self, marked):
+        '''
+        Marks or unmarks this edge.
+        @return: list of the square nodes which got marked because all
+        their edges are marked now
+        '''
         markedNodes = []
-        if self.marked != marked:
-            self.marked = True
+        if self.marked == marked:
+            return markedNodes
+        self.marked = marked
+        self.world.journal.record(ChangeJournal.MARKED, self)
+        if marked:
             self.world.markedEdges += 1
-            self.world.dirty = True
             # mark nodes if all their edges have been marked
-            nodes = [self.source, self.destination]
-            for node in nodes:
-                if node.type != Node.SQUARE:
-                    continue
-                allMarked = True
-                for edge in node.edges:
-                    if not edge.marked:
-                        allMarked = False
-                        break
-                if allMarked:
-                    node.marked = True
+            for node in (self.source, self.destination):
+                node._unmarkedEdges -= 1
+                if node._unmarkedEdges == 0 and node.type == Node.SQUARE:
+                    self.world._setNodeMarked(node, True)
                     markedNodes.append(node)
+        else:
+            self.world.markedEdges -= 1
+            for node in (self.source, self.destination):
+                node._unmarkedEdges += 1
+                self.world._setNodeMarked(node, False)
         return markedNodes
 
     def __str__(self):
         return "Edge{id=%i,src=%s,dst=%s,len=%i}" % (self.id, self.source.__str__(), self.destination.__str__(), self.length)
 
+class GridIndex(object):
+    '''
+    Uniform grid of buckets holding the nodes and edges covering each
+    cell, to find what is around a position without scanning the world.
+    Cells match the 20 pixel alignment of the nodes.
+    '''
+    CELL_SIZE = 20
+
+    def __init__(self):
+        # cell => list of nodes
+        self._nodeBuckets = {}
+        # cell => list of edges
+        self._edgeBuckets = {}
+        # node => cell
+        self._nodeCells = {}
+        # edge => list of cells
+        self._edgeCells = {}
+
+    def _getCell(self, pos):
+        return (int(pos[0]) // self.CELL_SIZE, int(pos[1]) // self.CELL_SIZE)
+
+    def _getCellsAround(self, pos, margin):
+        return self._getCellsInRect((pos[0] - margin, pos[1] - margin, pos[0] + margin, pos[1] + margin))
+
+    def _getCellsInRect(self, rect):
+        cell1 = self._getCell((rect[0], rect[1]))
+        cell2 = self._getCell((rect[2], rect[3]))
+        for x in range(cell1[0], cell2[0] + 1):
+            for y in range(cell1[1], cell2[1] + 1):
+                yield (x, y)
+
+    def addNode(self, node):
+        cell = self._getCell(node.pos)
+        self._nodeCells[node] = cell
+        self._nodeBuckets.setdefault(cell, []).append(node)
+
+    def removeNode(self, node):
+        cell = self._nodeCells.pop(node, None)
+        if cell != None:
+            self._nodeBuckets[cell].remove(node)
+
+    def addEdge(self, edge):
+        cell1 = self._getCell(edge.source.pos)
+        cell2 = self._getCell(edge.destination.pos)
+        cells = []
+        for x in range(min(cell1[0], cell2[0]), max(cell1[0], cell2[0]) + 1):
+            for y in range(min(cell1[1], cell2[1]), max(cell1[1], cell2[1]) + 1):
+                cells.append((x, y))
+                self._edgeBuckets.setdefault((x, y), []).append(edge)
+        self._edgeCells[edge] = cells
+
+    def removeEdge(self, edge):
+        cells = self._edgeCells.pop(edge, None)
+        if cells != None:
+            for cell in cells:
+                self._edgeBuckets[cell].remove(edge)
+
+    def getNodesAround(self, pos, margin):
+        '''
+        Returns the nodes of the cells touched by the given square area.
+        '''
+        nodes = []
+        for cell in self._getCellsAround(pos, margin):
+            nodes += self._nodeBuckets.get(cell, [])
+        return nodes
+
+    def getEdgesAround(self, pos, margin):
+        '''
+        Returns the edges crossing the cells touched by the given square
+        area, possibly several times.
+        '''
+        edges = []
+        for cell in self._getCellsAround(pos, margin):
+            edges += self._edgeBuckets.get(cell, [])
+        return edges
+
+    def getNodesInRect(self, rect):
+        '''
+        Returns the nodes of the cells touched by the given rectangle
+        given as (x1, y1, x2, y2).
+        '''
+        nodes = []
+        for cell in self._getCellsInRect(rect):
+            nodes += self._nodeBuckets.get(cell, [])
+        return nodes
+
+    def getEdgesInRect(self, rect):
+        '''
+        Returns the edges crossing the cells touched by the given rectangle
+        given as (x1, y1, x2, y2), possibly several times.
+        '''
+        edges = []
+        for cell in self._getCellsInRect(rect):
+            edges += self._edgeBuckets.get(cell, [])
+        return edges
+
+    def rebuild(self, nodes, edges):
+        self.__init__()
+        for node in nodes:
+            self.addNode(node)
+        for edge in edges:
+            self.addEdge(edge)
+
+class ChangeJournal(object):
+    '''
+    Log of the changes made to the nodes and edges of a world, tagged
+    with the tick during which they happened. Each consumer (renderer,
+    saver, replay...) remembers its own position in the journal and
+    only processes the changes made since then.
+    The oldest changes are dropped when the journal grows too large, in
+    which case consumers lagging behind must process the whole world.
+    '''
+    MARKED = 0
+    CREATED = 1
+    DELETED = 2
+    MOVED = 3
+    REVERSED = 4
+    # other attributes like the one way flag or the node type changed
+    UPDATED = 5
+
+    MAX_CHANGES = 10000
+
+    def __init__(self):
+        # list of (tick, change, node or edge)
+        self._changes = []
+        # position of the first change in self._changes
+        self._offset = 0
+        self.tick = 0
+
+    def record(self, change, obj):
+        self._changes.append((self.tick, change, obj))
+        if len(self._changes) > self.MAX_CHANGES:
+            dropped = len(self._changes) / 2
+            del self._changes[:dropped]
+            self._offset += dropped
+
+    def nextTick(self):
+        self.tick += 1
+
+    def getPosition(self):
+        '''
+        Returns the position after the last recorded change.
+        '''
+        return self._offset + len(self._changes)
+
+    def getChangesSince(self, position):
+        '''
+        Returns the list of (tick, change, node or edge) recorded since
+        the given position or None if some of them were already dropped.
+        '''
+        if position < self._offset:
+            return None
+        return self._changes[position - self._offset:]
+
+class OccupancyIndex(object):
+    '''
+    Entities on each node and edge of a world. An entity is on an edge
+    while it walks along it and on a node while it stands on it.
+    '''
+
+    def __init__(self):
+        # node or edge => list of entities
+        self._occupants = {}
+        # entity => node or edge
+        self._locations = {}
+
+    def move(self, entity, location):
+        '''
+        Moves the entity to the given node or edge, None to remove it.
+        '''
+        oldLocation = self._locations.pop(entity, None)
+        if oldLocation != None:
+            occupants = self._occupants[oldLocation]
+            occupants.remove(entity)
+            if not occupants:
+                del self._occupants[oldLocation]
+        if location != None:
+            self._locations[entity] = location
+            self._occupants.setdefault(location, []).append(entity)
+
+    def getOccupants(self, location):
+        return self._occupants.get(location, ())
+
+    def getLocation(self, entity):
+        return self._locations.get(entity)
+
+class EntityBatch(object):
+    '''
+    Positions and movements of the batchable entities of a world, in
+    NumPy arrays to move them all at once.
+    '''
+
+    def __init__(self, entities):
+        # index in the batch arrays for each entity, -1 if not batchable
+        self.indexes = []
+        self.entities = []
+        for entity in entities:
+            if entity.batchable:
+                self.indexes.append(len(self.entities))
+                self.entities.append(entity)
+            else:
+                self.indexes.append(-1)
+        # one row per entity: x, y, movement x, movement y,
+        # destination x, destination y, speed, moving
+        self.state = numpy.zeros((len(self.entities), 8), int)
+        self.pos = self.state[:, 0:2]
+        self.movement = self.state[:, 2:4]
+        self.destination = self.state[:, 4:6]
+        self.speed = self.state[:, 6]
+        self.moving = self.state[:, 7]
+        for index in range(len(self.entities)):
+            self.sync(index)
+
+    def sync(self, index):
+        '''
+        Copies the state of the entity at the given index into the arrays.
+        '''
+        entity = self.entities[index]
+        self.state[index] = (entity.pos[0], entity.pos[1], entity.movement[0], entity.movement[1],
+                             entity.destination[0], entity.destination[1], entity.speed, entity.moving)
+
+    def step(self):
+        '''
+        Moves all moving entities by one tick, like Entity.update() does.
+        @return: array telling which entities reached their target node
+        '''
+        movement = self.movement
+        speed = self.speed
+        # movement is (0, 0) for the entities which are not moving
+        self.pos += movement * speed[:, numpy.newaxis]
+        distance = numpy.abs(self.destination - self.pos)
+        return (self.moving != 0) & (((movement[:, 0] != 0) & (distance[:, 0] < speed)) |
+                                     ((movement[:, 1] != 0) & (distance[:, 1] < speed)))
+
+class GameEvent(object):
+    '''
+    Something that happened in the world during a tick and that the game
+    might want to react to, for example by playing a sound.
+    '''
+    # the player completed an edge which marked some nodes, data is the
+    # list of marked nodes
+    NODES_MARKED = 0
+    # the player stopped on a square node
+    PLAYER_STOPPED = 1
+
+    def __init__(self, eventType, entity, data = None):
+        self.type = eventType
+        self.entity = entity
+        self.data = data
+
+class WorldSnapshot(object):
+    '''
+    Compact copy of the nodes, edges, marks and foes of a world,
+    made by World.snapshot() and brought back by World.restore().
+    Nodes are referenced by their index in the list of nodes.
+    '''
+
+    def __init__(self, world):
+        # to know whether the topology changed since
+        self.world = world
+        self.revision = world.revision
+        self.title = world.title
+        self.subtitle = world.subtitle
+        self.endtext = world.endtext
+        self.hasNavigationTable = world.navigationTable != None
+        nodeIndexes = {}
+        # list of (pos, type, marked)
+        self.nodes = []
+        for node in world.nodes:
+            nodeIndexes[node] = len(self.nodes)
+            self.nodes.append((node.pos, node.type, node.marked))
+        # list of (source index, destination index, oneWay, marked, markedLength)
+        self.edges = [(nodeIndexes[edge.source], nodeIndexes[edge.destination], edge.oneWay, edge.marked, edge.markedLength)
+                      for edge in world.edges]
+        # list of (class, current node index, speed)
+        self.entities = []
+        for entity in world.entities:
+            if entity.entityType == Player.entityType:
+                continue
+            if entity.currentNode not in nodeIndexes:
+                # its node was deleted in the editor
+                print "Warning: skipping %s standing on deleted node %s" % (entity.__class__.__name__, entity.currentNode)
+                continue
+            self.entities.append((entity.__class__, nodeIndexes[entity.currentNode], entity.speed))
+        self.startNode = nodeIndexes.get(world.startNode)
+        if self.startNode == None and self.nodes:
+            # start node deleted, start from the first node instead
+            self.startNode = 0
+
 class World(object):
     '''
     World
@@ -167,28 +522,150 @@ class World(object):
     DOWN = 1
     LEFT = 2
     RIGHT = 3
+    # minimum number of entities to move them with NumPy, None to disable
+    BATCH_THRESHOLD = 64
 
     def __init__(self):
         self.nodes = []
         self.edges = []
         self.entities = []
         self.startNode = None
+        # full redraw needed, changes to single nodes and edges are
+        # recorded in the journal
         self.dirty = False
+        self.journal = ChangeJournal()
+        # game events emitted during the last tick
+        self.events = []
+        # number of updates since the world was loaded or restored
+        self.ticks = 0
+        # random generator of the foes, seeded by the game to replay
+        # recorded inputs
+        self.random = random.Random()
+        # batched entities, rebuilt when the entities change
+        self._entityBatch = None
+        # node or edge each entity is on
+        self._occupancy = OccupancyIndex()
         self.markedEdges = 0
         self.title = None
         self.subtitle = None
         self.endtext = None
-        global _nextEdgeId
-        global _nextNodeId
-        _nextEdgeId = 1
-        _nextNodeId = 1
+        # Optional precomputed navigation table, see buildNavigationTable()
+        self.navigationTable = None
+        # Contracted graph without joints, built on demand
+        self._navigationGraph = None
+        # Incremented on every topology change, for caches to detect
+        # that they are outdated
+        self.revision = 0
+        # Last flow field computed by getFlowField()
+        self._flowField = None
+        # ids of the next node and edge created in this world, ids are
+        # dense and zero-based to index tables with them
+        self._nextNodeId = 0
+        self._nextEdgeId = 0
+        # Spatial index for getNodeAt() and getEdgeAt()
+        self._gridIndex = GridIndex()
+        # position => node
+        self._nodesByPos = {}
+        # (source, destination) => edge
+        self._edgesByKey = {}
+        # bounding box of the nodes as [x1, y1, x2, y2], None if it needs
+        # to be recomputed
+        self._rect = None
+        self._rectDirty = False
 
     def update(self):
-        for entity in self.entities:
-            entity.update()
+        self.events = []
+        self.ticks += 1
+        self.journal.nextTick()
+        if numpy and self.BATCH_THRESHOLD != None and len(self.entities) >= self.BATCH_THRESHOLD:
+            self._updateBatched()
+        else:
+            for entity in self.entities:
+                entity.update()
+
+    def _updateBatched(self):
+        '''
+        Moves all batchable entities in one NumPy pass. Only those which
+        reached a node or are not moving go through their Python update().
+        '''
+        batch = self._entityBatch
+        if batch == None or len(batch.indexes) != len(self.entities):
+            batch = self._entityBatch = EntityBatch(self.entities)
+        arrived = batch.step().tolist()
+        moving = batch.moving.tolist()
+        positions = batch.pos.tolist()
+        # same order as the unbatched update, for the foes which read the
+        # state of the entity they track
+        for entity, index in zip(self.entities, batch.indexes):
+            if index < 0:
+                entity.update()
+            elif arrived[index]:
+                entity.onArrival()
+                batch.sync(index)
+            elif moving[index]:
+                pos = positions[index]
+                entity.pos = (pos[0], pos[1])
+            else:
+                entity.update()
+                if entity.moving:
+                    batch.sync(index)
+
+    def getEntitiesOn(self, location):
+        '''
+        Returns the entities on the given node or edge.
+        '''
+        return self._occupancy.getOccupants(location)
+
+    def getEntitiesNear(self, entity, distance = 10):
+        '''
+        Returns the other entities which are on the same node or edge as
+        the given entity, or on a node or edge passing closer than the
+        given distance to its position. Edges crossing without sharing a
+        node are found through the grid index.
+        Entities which are not returned are at least that far away on one
+        of the axes.
+        '''
+        location = self._occupancy.getLocation(entity)
+        if location == None:
+            return []
+        locations = set(self._gridIndex.getNodesAround(entity.pos, distance))
+        locations.update(self._gridIndex.getEdgesAround(entity.pos, distance))
+        locations.add(location)
+        occupancy = self._occupancy
+        entities = []
+        for location in locations:
+            for other in occupancy.getOccupants(location):
+                if other != entity:
+                    entities.append(other)
+        return entities
+
+    def getCollisions(self, entity, distance = 10):
+        '''
+        Returns the other entities which are closer than the given distance
+        to the given entity on both axes.
+        '''
+        collisions = []
+        for other in self.getEntitiesNear(entity, distance):
+            diff = vectorDiff(other.pos, entity.pos)
+            if abs(diff[0]) < distance and abs(diff[1]) < distance:
+                collisions.append(other)
+        return collisions
+
+    def _setEntityLocation(self, entity, location):
+        self._occupancy.move(entity, location)
+
+    def invalidateEntities(self):
+        '''
+        Must be called when entities were changed outside of update().
+        '''
+        self._entityBatch = None
+
+    def emitEvent(self, eventType, entity, data = None):
+        self.events.append(GameEvent(eventType, entity, data))
 
     def addEntity(self, entity):
         self.entities.append(entity)
+        self.invalidateEntities()
 
     def createSimpleFoe(self, startNode):
         if not startNode:
@@ -196,6 +673,7 @@ class World(object):
             return
         foe = SimpleFoe(startNode)
         self.entities.append(foe)
+        self.invalidateEntities()
         self.dirty = True
 
     def createTrackingFoe(self, startNode):
@@ -204,42 +682,68 @@ class World(object):
             return
         foe = TrackingFoe(startNode)
         self.entities.append(foe)
+        self.invalidateEntities()
         self.dirty = True
 
     def createNode(self, pos = (0, 0), nodeType = Node.SQUARE):
         # check for overlap
-        for node in self.nodes:
-            if node.pos == pos:
-                print "Warning: node overlap with %s" % node.__str__()
-                return node
+        node = self._nodesByPos.get(pos)
+        if node:
+            print "Warning: node overlap with %s" % node.__str__()
+            return node
 
         node = Node(self, pos, nodeType)
         self.nodes.append(node)
+        self._nodesByPos[pos] = node
+        self._gridIndex.addNode(node)
+        self._extendRect(pos)
+        self.journal.record(ChangeJournal.CREATED, node)
         self.dirty = True
+        self.onTopologyChanged()
         return node
 
     def deleteNode(self, node):
         node.deleted = True
         self.nodes.remove(node)
+        if self._nodesByPos.get(node.pos) == node:
+            del self._nodesByPos[node.pos]
+        self._gridIndex.removeNode(node)
+        rect = self._rect
+        if rect and (node.pos[0] in (rect[0], rect[2]) or node.pos[1] in (rect[1], rect[3])):
+            # node was on the border
+            self._rectDirty = True
         for edge in list(node.edges):
             self.deleteEdge(edge)
+        self.journal.record(ChangeJournal.DELETED, node)
         self.dirty = True
+        self.onTopologyChanged()
 
     def deleteEdge(self, edge):
-        if edge.source:
-            edge.source.edges.remove(edge)
-        if edge.destination:
-            edge.destination.edges.remove(edge)
+        if edge.marked:
+            self.markedEdges -= 1
+        for node in (edge.source, edge.destination):
+            if node:
+                node.edges.remove(edge)
+                if not edge.marked:
+                    node._unmarkedEdges -= 1
+                    self._updateNodeMarked(node)
+                node.onEdgesChanged()
         edge.deleted = True
         self.edges.remove(edge)
+        self._removeEdgeKey(edge)
+        self._gridIndex.removeEdge(edge)
+        self.journal.record(ChangeJournal.DELETED, edge)
         self.dirty = True
+        self.onTopologyChanged()
 
     def connectNode(self, node1, node2 ):
         self.dirty = True
-        self.edges.append( node1.connect(node2) )
+        self._addEdge( node1.connect(node2) )
+        self.onTopologyChanged()
 
     def connectNodeWithJoint(self, node1, node2, reverse = False, oneWay = False):
         self.dirty = True
+        self.onTopologyChanged()
         if node1.pos[0] == node2.pos[0] or node1.pos[1] == node2.pos[1]:
             if reverse:
                 edge = node2.connect(node1, oneWay)
@@ -257,32 +761,228 @@ class World(object):
     def _addEdge(self, newEdge):
         if not newEdge:
             return
-        for edge in self.edges:
-            if edge.source.id == newEdge.source.id and edge.destination.id == newEdge.destination.id:
-                print "Warning: duplicate edge: %s" % edge.__str__()
-                return
+        edge = self._edgesByKey.get((newEdge.source, newEdge.destination))
+        if edge:
+            print "Warning: duplicate edge: %s" % edge.__str__()
+            return
         self.edges.append(newEdge)
+        self._addEdgeKey(newEdge)
+        self._gridIndex.addEdge(newEdge)
+        self.journal.record(ChangeJournal.CREATED, newEdge)
 
-    def getNodeAt(self, pos, margin = 5):
+    def _addEdgeKey(self, edge):
+        self._edgesByKey[(edge.source, edge.destination)] = edge
+
+    def _removeEdgeKey(self, edge):
+        key = (edge.source, edge.destination)
+        if self._edgesByKey.get(key) == edge:
+            del self._edgesByKey[key]
+
+    def getEdgeBetween(self, node1, node2):
+        '''
+        Returns the edge connecting both nodes in any direction
+        or None if they are not connected.
+        '''
+        edge = self._edgesByKey.get((node1, node2))
+        if not edge:
+            edge = self._edgesByKey.get((node2, node1))
+        return edge
+
+    def onTopologyChanged(self):
+        '''
+        Must be called whenever nodes or edges are added, removed,
+        change direction or nodes change type.
+        '''
+        self.revision += 1
+        # the table and graph don't match the world any more
+        self.navigationTable = None
+        self._navigationGraph = None
+        self._flowField = None
+
+    def snapshot(self):
+        '''
+        Returns a snapshot of the nodes, edges, marks and foes of this world.
+        The player is not part of it, it is managed by the game.
+        Foes are saved as standing on the last node they reached.
+        '''
+        return WorldSnapshot(self)
+
+    def restore(self, snapshot):
+        '''
+        Brings this world back to the state of the given snapshot.
+        If the snapshot was made from this world and the topology did not
+        change since, the nodes, edges and navigation structures are
+        kept and only the marks and foes are reset.
+        '''
+        if snapshot.world != self or snapshot.revision != self.revision or len(snapshot.nodes) != len(self.nodes):
+            self._rebuild(snapshot)
+
+        moved = False
+        for node, (pos, nodeType, marked) in zip(self.nodes, snapshot.nodes):
+            if node.pos != pos:
+                node.pos = pos
+                moved = True
+            node.marked = marked
+            node._unmarkedEdges = 0
+        self.markedEdges = 0
+        for edge, (source, destination, oneWay, marked, markedLength) in zip(self.edges, snapshot.edges):
+            edge.marked = marked
+            edge.markedLength = markedLength
+            if marked:
+                self.markedEdges += 1
+            else:
+                edge.source._unmarkedEdges += 1
+                edge.destination._unmarkedEdges += 1
+        if moved:
+            self._rect = None
+            self._onNodesMoved()
+
+        self.entities = []
+        self._occupancy = OccupancyIndex()
+        self.invalidateEntities()
+        for entityClass, nodeIndex, speed in snapshot.entities:
+            entity = entityClass(self.nodes[nodeIndex])
+            entity.speed = speed
+            self.entities.append(entity)
+        if snapshot.startNode != None:
+            self.startNode = self.nodes[snapshot.startNode]
+        else:
+            self.startNode = None
+        self.events = []
+        self.ticks = 0
+        self.dirty = True
+
+    def _rebuild(self, snapshot):
+        '''
+        Recreates the nodes and edges of the given snapshot.
+        '''
+        self.__init__()
+        self.title = snapshot.title
+        self.subtitle = snapshot.subtitle
+        self.endtext = snapshot.endtext
+        for pos, nodeType, marked in snapshot.nodes:
+            node = Node(self, pos, nodeType)
+            self.nodes.append(node)
+            self._nodesByPos[pos] = node
+            self._gridIndex.addNode(node)
+            self._extendRect(pos)
+        for source, destination, oneWay, marked, markedLength in snapshot.edges:
+            self._addEdge(self.nodes[source].connect(self.nodes[destination], oneWay))
+        self.onTopologyChanged()
+        if snapshot.hasNavigationTable:
+            self.buildNavigationTable()
+        # the snapshot matches this world now
+        snapshot.world = self
+        snapshot.revision = self.revision
+
+    def getNavigationGraph(self):
+        '''
+        Returns the contracted graph of this world where chains of joints
+        are replaced with corridors between square nodes.
+        '''
+        if not self._navigationGraph:
+            self._navigationGraph = NavigationGraph()
+            self._navigationGraph.build(self.nodes)
+        return self._navigationGraph
+
+    def buildNavigationTable(self, maxEntries = 40000):
+        '''
+        Precomputes the next edge to follow between every pair of square
+        nodes, to make path queries simple lookups.
+        The table is only built if it doesn't exceed the given number of
+        entries, else paths are computed with A*.
+        @param maxEntries: maximum number of (node, target) entries
+        @return: True if the table was built, False otherwise
+        '''
+        self.navigationTable = None
+        squaresCount = 0
         for node in self.nodes:
+            if node.type == Node.SQUARE:
+                squaresCount += 1
+        if squaresCount * squaresCount > maxEntries:
+            return False
+        navigationTable = NavigationTable()
+        navigationTable.build(self.getNavigationGraph(), self.nodes)
+        self.navigationTable = navigationTable
+        return True
+
+    def _allocateNodeId(self):
+        nodeId = self._nextNodeId
+        self._nextNodeId += 1
+        return nodeId
+
+    def _allocateEdgeId(self):
+        edgeId = self._nextEdgeId
+        self._nextEdgeId += 1
+        return edgeId
+
+    def getMaxNodeId(self):
+        '''
+        Returns the highest node id allocated so far, for tables indexed by
+        node id, or -1 if no node was created.
+        '''
+        return self._nextNodeId - 1
+
+    def getMaxEdgeId(self):
+        '''
+        Returns the highest edge id allocated so far, for tables indexed by
+        edge id, or -1 if no edge was created.
+        '''
+        return self._nextEdgeId - 1
+
+    def getFlowField(self, target):
+        '''
+        Returns the flow field towards the given target node, to be shared
+        by all entities heading there. It is taken from the navigation
+        table if available, else it is only recomputed when the target
+        is different from the one of the previous call, and only searched
+        as far as the entities asking for a path.
+        '''
+        if self.navigationTable and self.navigationTable.hasTarget(target):
+            return self.navigationTable.getFlowField(target)
+        if not self._flowField or self._flowField.target != target:
+            self._flowField = FlowField(self.getNavigationGraph(), target)
+        return self._flowField
+
+    def getNodeAt(self, pos, margin = 5):
+        found = None
+        for node in self._gridIndex.getNodesAround(pos, margin):
             dist = vectorDiff(node.pos, pos)
             if abs(dist[0]) <= margin and abs(dist[1]) <= margin:
-                return node
-        return None
+                # prefer the oldest node, like a scan of the nodes would
+                if not found or node.id < found.id:
+                    found = node
+        return found
 
     def getEdgeAt(self, pos, margin = 5):
-        for edge in self.edges:
+        found = None
+        for edge in self._gridIndex.getEdgesAround(pos, margin):
             pos1 = edge.source.pos
             pos2 = edge.destination.pos
             if pos1[1] == pos2[1]:
                 # horizontal
-                if abs(pos[1] - pos1[1]) < margin and between(pos[0], pos1[0], pos2[0]):
-                    return edge
+                match = abs(pos[1] - pos1[1]) < margin and between(pos[0], pos1[0], pos2[0])
             else:
                 # vertical
-                if abs(pos[0] - pos1[0]) < margin and between(pos[1], pos1[1], pos2[1]):
-                    return edge
-        return None
+                match = abs(pos[0] - pos1[0]) < margin and between(pos[1], pos1[1], pos2[1])
+            # prefer the oldest edge, like a scan of the edges would
+            if match and (not found or edge.id < found.id):
+                found = edge
+        return found
+
+    def getNodesInRect(self, rect):
+        '''
+        Returns the nodes which might be in the given rectangle (x1, y1, x2, y2),
+        possibly including a few nodes around it.
+        '''
+        return self._gridIndex.getNodesInRect(rect)
+
+    def getEdgesInRect(self, rect):
+        '''
+        Returns the set of edges which might cross the given rectangle
+        (x1, y1, x2, y2), possibly including a few edges around it.
+        '''
+        return set(self._gridIndex.getEdgesInRect(rect))
 
     def translate(self, offset):
         '''
@@ -293,6 +993,8 @@ class World(object):
             node.pos = (node.pos[0] + offset[0], node.pos[1] + offset[1])
         for entity in self.entities:
             entity.pos = (entity.pos[0] + offset[0], entity.pos[1] + offset[1])
+        self.invalidateEntities()
+        self._onNodesMoved()
 
     def centerInView(self, viewport):
         rect = self.getRect()
@@ -305,7 +1007,34 @@ class World(object):
     def alignNodes(self):
         for node in self.nodes:
             node.pos = (node.pos[0] / 20 * 20, node.pos[1] / 20 * 20)
+        self._onNodesMoved()
         self.dirty = True
+        self.onTopologyChanged()
+
+    def _onNodesMoved(self):
+        self._nodesByPos = {}
+        for node in self.nodes:
+            self._nodesByPos[node.pos] = node
+            # directions change when aligning collapses edges
+            node.onEdgesChanged()
+            self.journal.record(ChangeJournal.MOVED, node)
+        self._gridIndex.rebuild(self.nodes, self.edges)
+        self._rectDirty = True
+
+    def _extendRect(self, pos):
+        rect = self._rect
+        if not rect:
+            if not self._rectDirty:
+                self._rect = [pos[0], pos[1], pos[0], pos[1]]
+            return
+        if pos[0] < rect[0]:
+            rect[0] = pos[0]
+        if pos[0] > rect[2]:
+            rect[2] = pos[0]
+        if pos[1] < rect[1]:
+            rect[1] = pos[1]
+        if pos[1] > rect[3]:
+            rect[3] = pos[1]
 
     def getRect(self):
         '''
@@ -314,29 +1043,43 @@ class World(object):
         '''
         if len(self.nodes) == 0:
             return (0, 0, 0, 0)
-        firstNode = self.nodes[0]
-        rect = [firstNode.pos[0], firstNode.pos[1], firstNode.pos[0], firstNode.pos[1]]
-        for node in self.nodes[1:]:
-            if node.pos[0] < rect[0]:
-                rect[0] = node.pos[0]
-            if node.pos[0] > rect[2]:
-                rect[2] = node.pos[0]
-            if node.pos[1] < rect[1]:
-                rect[1] = node.pos[1]
-            if node.pos[1] > rect[3]:
-                rect[3] = node.pos[1]
-
-        return tuple(rect)
+        if self._rectDirty:
+            self._rect = None
+            self._rectDirty = False
+            for node in self.nodes:
+                self._extendRect(node.pos)
+        return tuple(self._rect)
+
+    def _setNodeMarked(self, node, marked):
+        if node.marked == marked:
+            return
+        node.marked = marked
+        self.journal.record(ChangeJournal.MARKED, node)
+
+    def _updateNodeMarked(self, node):
+        '''
+        Marks the given square node if it has edges and all of them are marked.
+        '''
+        if node.type == Node.SQUARE and node.edges and node._unmarkedEdges == 0:
+            self._setNodeMarked(node, True)
 
     def hasAllEdgesMarked(self):
         return self.markedEdges == len(self.edges)
 
 class Entity(object):
     entityType = -1
+    # whether World.update() can move this entity with NumPy, only for
+    # entities which don't react to onMoving()
+    batchable = False
     def __init__(self, currentNode = None):
         self.pos = (0, 0)
         self.currentNode = None
         self.currentEdge = None
+        # node or edge the entity is registered on in its world
+        self._location = None
+        # corridor being walked along and index of the current edge in it
+        self._corridor = None
+        self._corridorIndex = 0
         self.setCurrentNode(currentNode)
         self.movement = (0, 0)
         self.moving = False
@@ -349,13 +1092,29 @@ class Entity(object):
         self.dead = True
 
     def moveTo(self, targetNode):
+        self._corridor = None
+        world = targetNode.world
+        self._setLocation(world.getEdgeBetween(self.currentNode, targetNode) or self.currentNode)
         self.targetNode = targetNode
         self.destination = targetNode.pos
         self.move(unitVector(vectorDiff(self.destination, self.pos)))
 
     def moveAlong(self, targetEdge):
-        self.currentEdge = targetEdge
-        self.moveTo( targetEdge.getOther(self.currentNode) )
+        '''
+        Moves along the given edge and through all following joints,
+        until the next square node.
+        '''
+        self._corridor = self.currentNode.world.getNavigationGraph().getCorridor(self.currentNode, targetEdge)
+        self._corridorIndex = 0
+        self._moveAlongCorridor()
+
+    def _moveAlongCorridor(self):
+        index = self._corridorIndex
+        self.currentEdge = self._corridor.edges[index]
+        self._setLocation(self.currentEdge)
+        self.targetNode = self._corridor.nodes[index + 1]
+        self.destination = self.targetNode.pos
+        self.move(self._corridor.directions[index])
 
     def move(self, movement = (0, 0)):
         self.movement = movement
@@ -369,27 +1128,45 @@ class Entity(object):
 
             distance = vectorDiff(self.destination, self.pos)
             if ( self.movement[0] != 0 and abs(distance[0]) < self.speed ) or ( self.movement[1] != 0 and abs(distance[1]) < self.speed ):
-                self.pos = self.targetNode.pos
-                self.currentNode = self.targetNode
-                self.onEdgeComplete(self.currentEdge)
-                if self.currentNode.type == Node.JOINT:
-                    # need to continue along the next edge
-                    edge = self.currentNode.getOtherEdge(self.currentEdge)
-                    self.moveAlong( edge )
-                else:
-                    self.onStopMoving()
-                    self.moving = False
-                    self.movement = (0, 0)
-                    self.targetNode = None
-                    self.currentEdge = None
+                self.onArrival()
+
+    def onArrival(self):
+        '''
+        Called when the entity reached its target node.
+        '''
+        self.pos = self.targetNode.pos
+        self.currentNode = self.targetNode
+        self.onEdgeComplete(self.currentEdge)
+        if self._corridor and self._corridorIndex < len(self._corridor.edges) - 1:
+            # need to continue along the next edge
+            self._corridorIndex += 1
+            self._moveAlongCorridor()
+        else:
+            self._setLocation(self.currentNode)
+            self.onStopMoving()
+            self.moving = False
+            self.movement = (0, 0)
+            self.targetNode = None
+            self.currentEdge = None
+            self._corridor = None
 
     def getFinalTargetNode(self):
         if not self.moving:
             return None
-        if self.targetNode.type == Node.JOINT:
-            return self.currentNode.getNextNode(self.currentEdge)
+        if self._corridor:
+            return self._corridor.destination
         return self.targetNode
 
+    def _setLocation(self, location):
+        if location == self._location:
+            return
+        oldLocation = self._location
+        self._location = location
+        if oldLocation != None and (location == None or location.world != oldLocation.world):
+            oldLocation.world._setEntityLocation(self, None)
+        if location != None:
+            location.world._setEntityLocation(self, location)
+
     def onEdgeComplete(self, edge):
         pass
 
@@ -401,6 +1178,7 @@ class Entity(object):
 
     def setCurrentNode(self, currentNode = None):
         self.currentNode = currentNode
+        self._setLocation(currentNode)
         if currentNode:
             self.pos = currentNode.pos
         else:
@@ -408,20 +1186,38 @@ class Entity(object):
 
 class Player(Entity):
     entityType = 0
+    # movement of World.UP, DOWN, LEFT and RIGHT
+    _movements = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+
     def __init__(self, currentNode = None):
         Entity.__init__(self, currentNode)
         self.speed = 2
         self.justMarked = False
 
+    def moveTowards(self, direction):
+        '''
+        Moves along the edge going to the given direction from the current
+        node, if there is one and the player is not already moving.
+        @param direction: World.UP, DOWN, LEFT or RIGHT
+        @return: True if the player started moving
+        '''
+        if self.moving:
+            return False
+        edge = self.currentNode.getEdgeByDirection(self._movements[direction])
+        if not edge:
+            return False
+        self.moveAlong(edge)
+        return True
+
     def onEdgeComplete(self, edge):
         if not edge.isMarked():
             markedNodes = edge.setMarked(True)
             if len(markedNodes) > 0:
-                sound.soundManager.play(sound.soundManager.DRAW)
+                edge.world.emitEvent(GameEvent.NODES_MARKED, self, markedNodes)
 
     def onStopMoving(self):
         if self.currentNode.type != Node.JOINT:
-            sound.soundManager.play(sound.soundManager.MOVE)
+            self.currentNode.world.emitEvent(GameEvent.PLAYER_STOPPED, self)
 
     def onMoving(self, oldPos, newPos):
         if not self.currentEdge.marked:
@@ -434,6 +1230,7 @@ class Player(Entity):
 
 class Foe(Entity):
     entityType = 1
+    batchable = True
     def __init__(self, currentNode = None):
         Entity.__init__(self, currentNode)
 
@@ -453,7 +1250,7 @@ class SimpleFoe(Foe):
         else:
             # find path
             nextEdges = self.currentNode.getOutgoingEdges()
-            index = random.randint(0, len(nextEdges) - 1)
+            index = self.currentNode.world.random.randint(0, len(nextEdges) - 1)
             nextEdge = nextEdges[index]
             if nextEdge == self.lastEdge:
                 if index >= len(nextEdges) - 1:
@@ -470,6 +1267,11 @@ class TrackingFoe(Foe):
     Foe that tracks another entity (the player) and finds the shortest path.
     '''
     foeType = 1
+    # Path planning strategies
+    # shared flow field towards the tracked entity's target
+    STRATEGY_FLOW_FIELD = 0
+    # own incremental search, repaired when the target moves
+    STRATEGY_INCREMENTAL = 1
 
     def __init__(self, currentNode = None, trackedEntity = None):
         Foe.__init__(self, currentNode)
@@ -478,11 +1280,27 @@ class TrackingFoe(Foe):
         self._trackedTarget = None
         self._path = []
         self._sleepTicks = 0
+        self._strategy = TrackingFoe.STRATEGY_FLOW_FIELD
+        self._pathFinder = None
 
     def track(self, trackedEntity):
         self._trackedEntity = trackedEntity
         self._path = []
 
+    def setStrategy(self, strategy):
+        self._strategy = strategy
+        self._path = []
+        if strategy == TrackingFoe.STRATEGY_INCREMENTAL:
+            self._pathFinder = IncrementalPathFinder()
+        else:
+            self._pathFinder = None
+
+    def _findPath(self, targetNode):
+        if self._strategy == TrackingFoe.STRATEGY_INCREMENTAL:
+            return self._pathFinder.findShortestPath(self.currentNode, targetNode)
+        # all tracking foes share the same flow field
+        return self.currentNode.world.getFlowField(targetNode).getPath(self.currentNode)
+
     def update(self):
         if self._sleepTicks > 0:
             self._sleepTicks -= 1
@@ -497,7 +1315,7 @@ class TrackingFoe(Foe):
                 nextEdge = self._path[0]
                 self._path = self._path[1:]
                 self.moveAlong(nextEdge)
-            elif random.randint(0, 5) == 0:
+            elif self.currentNode.world.random.randint(0, 5) == 0:
                 # sleep for a second
                 self._sleepTicks = 60
             elif self._trackedEntity and ( self._trackedEntity.currentNode != self.currentNode or
@@ -507,7 +1325,7 @@ class TrackingFoe(Foe):
                     # directly go to that entity's target
                     targetNode = self._trackedEntity.getFinalTargetNode()
                 if targetNode != self.currentNode:
-                    self._path = pathFinder.findShortestPath(self.currentNode, targetNode)
+                    self._path = self._findPath(targetNode)
                     self._trackedTarget = targetNode
 
 class GameState(object):
@@ -0,0 +1,204 @@
+'''
+    This file is part of nodereviver
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    @author: Vincent Petry <PVince81@yahoo.fr>
+'''
+import time
+import cProfile
+from model import GameState
+
+_stateNames = dict([(value, name.lower()) for name, value in vars(GameState).items() if name.isupper()])
+
+class FrameProfiler(object):
+    '''
+    Records how long each phase of the last frames took, in a ring buffer
+    of fixed size.
+    '''
+    INPUT = 0
+    LOGIC = 1
+    UPDATE = 2
+    RENDER = 3
+    FLIP = 4
+    # time spent sleeping or waiting for input
+    WAIT = 5
+    phaseNames = ["input", "logic", "update", "render", "flip", "wait"]
+
+    def __init__(self, size = 3600):
+        '''
+        @param size: number of frames to keep
+        '''
+        self.size = size
+        self._timings = [[0.0] * len(self.phaseNames) for x in range(size)]
+        # total number of recorded frames
+        self.frames = 0
+        self._current = self._timings[0]
+        self._lastTime = None
+        self._inFrame = False
+
+    def beginFrame(self):
+        self._current = self._timings[self.frames % self.size]
+        for phase in range(len(self._current)):
+            self._current[phase] = 0.0
+        self._inFrame = True
+        self._lastTime = time.time()
+
+    def mark(self, phase):
+        '''
+        Adds the time elapsed since the last mark to the given phase
+        of the current frame.
+        '''
+        now = time.time()
+        self._current[phase] += (now - self._lastTime) * 1000.0
+        self._lastTime = now
+
+    def endFrame(self):
+        self._inFrame = False
+        self.frames += 1
+
+    def _getFrames(self):
+        '''
+        Returns the recorded frames, from the oldest to the newest.
+        '''
+        if self.frames < self.size:
+            return self._timings[:self.frames]
+        start = self.frames % self.size
+        if self._inFrame:
+            # the oldest frame is being overwritten
+            return self._timings[start + 1:] + self._timings[:start]
+        return self._timings[start:] + self._timings[:start]
+
+    def getPercentiles(self, phase = None, percentiles = (50, 95, 99)):
+        '''
+        Returns the given percentiles of a phase duration in milliseconds.
+        @param phase: phase index or None for the whole frame without
+        the waiting time
+        @return: list of durations, one per percentile
+        '''
+        frames = self._getFrames()
+        if not frames:
+            return [0.0] * len(percentiles)
+        if phase == None:
+            values = [sum(timings[:self.WAIT]) for timings in frames]
+        else:
+            values = [timings[phase] for timings in frames]
+        values.sort()
+        result = []
+        for percentile in percentiles:
+            index = min(len(values) - 1, int(len(values) * percentile / 100.0))
+            result.append(values[index])
+        return result
+
+    def saveCsv(self, fileName):
+        '''
+        Writes the recorded frames to a CSV file, one row per frame.
+        '''
+        f = open(fileName, "w")
+        f.write(",".join(["frame"] + self.phaseNames) + "\n")
+        frameNum = max(0, self.frames - self.size)
+        for timings in self._getFrames():
+            f.write("%i,%s\n" % (frameNum, ",".join(["%.3f" % value for value in timings])))
+            frameNum += 1
+        f.close()
+
+class StateProfiler(object):
+    '''
+    Collects a separate cProfile profile for each game state and level,
+    for example to compare a level with the title demo.
+    '''
+    # states which don't belong to a level
+    _levelessStates = [GameState.TITLE, GameState.STORY, GameState.ENDGAME]
+
+    def __init__(self, gameState, filePrefix = "profile"):
+        '''
+        @param gameState: game state to follow
+        @param filePrefix: prefix of the written pstats files
+        '''
+        self._gameState = gameState
+        self._filePrefix = filePrefix
+        self._profiles = {}
+        self._currentKey = None
+        self._current = None
+        self.enabled = False
+
+    def _getKey(self):
+        state = self._gameState.state
+        if state == GameState.QUIT:
+            # nothing interesting happens after quitting
+            return None
+        if state in self._levelessStates:
+            return (state, None)
+        return (state, self._gameState.worldNum)
+
+    def start(self):
+        '''
+        Starts capturing, profiles of the same state and level are
+        accumulated with the ones of the previous captures.
+        '''
+        self.enabled = True
+        self.update()
+
+    def stop(self):
+        '''
+        Stops capturing and writes the profiles.
+        @return: list of written file names
+        '''
+        self._switchTo(None)
+        self.enabled = False
+        return self.save()
+
+    def update(self):
+        '''
+        Must be called regularly, switches to the profile of the current
+        state when it changed.
+        '''
+        if not self.enabled:
+            return
+        key = self._getKey()
+        if key != self._currentKey:
+            self._switchTo(key)
+
+    def _switchTo(self, key):
+        if self._current:
+            self._current.disable()
+        self._currentKey = key
+        if key == None:
+            self._current = None
+            return
+        profile = self._profiles.get(key)
+        if profile == None:
+            profile = cProfile.Profile()
+            self._profiles[key] = profile
+        self._current = profile
+        profile.enable()
+
+    def getFileName(self, key):
+        state, level = key
+        fileName = "%s-%s" % (self._filePrefix, _stateNames.get(state, state))
+        if level != None:
+            fileName += "-level%i" % level
+        return fileName + ".pstats"
+
+    def save(self):
+        '''
+        Writes one pstats file per state and level.
+        @return: list of written file names
+        '''
+        fileNames = []
+        for key in sorted(self._profiles.keys()):
+            fileName = self.getFileName(key)
+            self._profiles[key].dump_stats(fileName)
+            fileNames.append(fileName)
+        return fileNames
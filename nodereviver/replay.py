@@ -0,0 +1,162 @@
+'''
+    This file is part of nodereviver
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    @author: Vincent Petry <PVince81@yahoo.fr>
+'''
+try:
+    import json
+except:
+    import simplejson as json
+import collections
+
+import model
+
+class InputScript(object):
+    '''
+    Player moves of one attempt at a level, as (tick, direction) pairs
+    where tick is the number of world updates before the move.
+    Replaying them on the same level with the same seed gives the same game.
+    '''
+    COMPLETED = "completed"
+    DEAD = "dead"
+    # version 2: incremental tracking picks the same path in every process,
+    # older scripts using it may not replay the same way
+    VERSION = 2
+
+    def __init__(self, worldNum = 0, seed = 0):
+        self.version = self.VERSION
+        self.worldNum = worldNum
+        # seed of the world's random generator
+        self.seed = seed
+        self.playerSpeed = 2
+        self.incrementalTracking = False
+        self.moves = []
+        # tick from which the player can collide with foes, None if never
+        self.startTick = None
+        # how the attempt ended, None if it was interrupted
+        self.result = None
+        # number of ticks of the attempt
+        self.ticks = 0
+
+    def record(self, tick, direction):
+        self.moves.append((tick, direction))
+
+    def finish(self, result, ticks):
+        self.result = result
+        self.ticks = ticks
+
+    def isDeterministic(self):
+        '''
+        Returns whether replaying the script is expected to give the
+        recorded result.
+        '''
+        return not self.incrementalTracking or self.version >= 2
+
+    def toDict(self):
+        # ticks are stored as increments and packed with the direction
+        moves = []
+        lastTick = 0
+        for tick, direction in self.moves:
+            moves.append((tick - lastTick) * 4 + direction)
+            lastTick = tick
+        return {"version": self.version, "world": self.worldNum, "seed": self.seed, "speed": self.playerSpeed,
+                "incrementalTracking": self.incrementalTracking, "startTick": self.startTick,
+                "result": self.result, "ticks": self.ticks, "moves": moves}
+
+    def fromDict(self, element):
+        self.version = element.get("version", 1)
+        self.worldNum = element["world"]
+        self.seed = element["seed"]
+        self.playerSpeed = element.get("speed", 2)
+        self.incrementalTracking = element.get("incrementalTracking", False)
+        self.startTick = element.get("startTick")
+        self.result = element.get("result")
+        self.ticks = element.get("ticks", 0)
+        self.moves = []
+        tick = 0
+        for move in element["moves"]:
+            tick += move / 4
+            self.moves.append((tick, move % 4))
+
+class InputReplay(object):
+    '''
+    Gives back the moves of a script as the ticks go by.
+    '''
+    def __init__(self, script):
+        self.script = script
+        self._moves = collections.deque(script.moves)
+
+    def getMoves(self, tick):
+        '''
+        Returns the directions to apply before the given tick.
+        '''
+        moves = []
+        while self._moves and self._moves[0][0] <= tick:
+            moves.append(self._moves.popleft()[1])
+        return moves
+
+    def isFinished(self):
+        return len(self._moves) == 0
+
+def loadScripts(fileName):
+    '''
+    Returns the list of the input scripts saved in the given file.
+    '''
+    f = open(fileName, "r")
+    root = json.load(f)
+    f.close()
+    scripts = []
+    for element in root["scripts"]:
+        script = InputScript()
+        script.fromDict(element)
+        scripts.append(script)
+    return scripts
+
+def saveScripts(fileName, scripts):
+    f = open(fileName, "w")
+    json.dump({"scripts": [script.toDict() for script in scripts]}, f)
+    f.close()
+
+def runScript(world, script):
+    '''
+    Replays a script without display on a freshly loaded world of its level,
+    with the rules of the game: the level is completed once all edges
+    are marked and the player dies when touching a foe.
+    @return: (result, ticks), result is None if the attempt didn't end
+    within the recorded number of ticks
+    '''
+    world.random.seed(script.seed)
+    player = model.Player()
+    player.speed = script.playerSpeed
+    player.setCurrentNode(world.startNode)
+    world.addEntity(player)
+    for entity in world.entities:
+        if entity.entityType == 1 and entity.foeType == 1:
+            entity.track(player)
+            if script.incrementalTracking:
+                entity.setStrategy(model.TrackingFoe.STRATEGY_INCREMENTAL)
+
+    replay = InputReplay(script)
+    while world.ticks < script.ticks:
+        tick = world.ticks
+        for direction in replay.getMoves(tick):
+            player.moveTowards(direction)
+        world.update()
+        if world.hasAllEdgesMarked():
+            return (InputScript.COMPLETED, world.ticks)
+        if script.startTick != None and tick >= script.startTick and world.getCollisions(player):
+            return (InputScript.DEAD, world.ticks)
+    return (None, world.ticks)
@@ -0,0 +1,93 @@
+'''
+    This file is part of nodereviver
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    @author: Vincent Petry <PVince81@yahoo.fr>
+'''
+import time
+
+def _getTime():
+    return time.time() * 1000.0
+
+class Scheduler(object):
+    '''
+    Fixed timestep scheduler: the time elapsed between frames is
+    accumulated and consumed by logic ticks of a fixed duration.
+    After a stall, at most maxCatchUpTicks ticks are run in the same frame
+    and the remaining time is dropped, so that a slow device doesn't spend
+    more and more time catching up.
+    '''
+
+    def __init__(self, tickRate = 60, maxCatchUpTicks = 5, getTime = None):
+        '''
+        @param tickRate: number of logic ticks per second
+        @param maxCatchUpTicks: maximum number of ticks run in one frame
+        @param getTime: function returning the current time in milliseconds
+        '''
+        self.tickDuration = 1000.0 / tickRate
+        self.maxCatchUpTicks = maxCatchUpTicks
+        if getTime == None:
+            getTime = _getTime
+        self._getTime = getTime
+        self._lastTime = None
+        # time not consumed by ticks yet, in milliseconds
+        self._accumulator = 0.0
+        self.frames = 0
+        self.ticks = 0
+        # ticks skipped because of the catch-up limit
+        self.droppedTicks = 0
+        # ticks run later than their time slot, to catch up
+        self.lateTicks = 0
+
+    def reset(self):
+        '''
+        Forgets the time elapsed since the last frame, for example after
+        the game was paused or in the background.
+        '''
+        self._lastTime = None
+        self._accumulator = 0.0
+
+    def advance(self):
+        '''
+        Must be called once per frame.
+        @return: number of logic ticks to run in this frame
+        '''
+        now = self._getTime()
+        if self._lastTime == None:
+            self._lastTime = now
+            return 0
+        self._accumulator += now - self._lastTime
+        self._lastTime = now
+        self.frames += 1
+
+        steps = int(self._accumulator / self.tickDuration)
+        self._accumulator -= steps * self.tickDuration
+        if steps > self.maxCatchUpTicks:
+            self.droppedTicks += steps - self.maxCatchUpTicks
+            steps = self.maxCatchUpTicks
+        if steps > 1:
+            self.lateTicks += steps - 1
+        self.ticks += steps
+        return steps
+
+    def getInterpolation(self):
+        '''
+        Returns how far the current time is between the last tick and the
+        next one, from 0.0 to 1.0, to interpolate the rendering.
+        '''
+        return min(self._accumulator / self.tickDuration, 1.0)
+
+    def __str__(self):
+        return "frames=%i ticks=%i late=%i dropped=%i" % (self.frames, self.ticks, self.lateTicks, self.droppedTicks)
@@ -204,6 +204,10 @@ class Display(object):
         self._endStory = None
         self.selectionView = SelectionView()
         self._edgeView = EdgeView(None, self.context)
+        # to skip the rendering when nothing changed
+        self._invalidated = True
+        self._lastRenderState = None
+        self._profilerView = None
 
         # UGLY, I know... but I'm tired to pass everything along
         global _spriteSurface
@@ -214,7 +218,25 @@ class Display(object):
         _spriteSurface = _spriteSurface.convert(screen)
         _spriteSurface.set_colorkey((255, 0, 255), pygame.RLEACCEL)
 
+    def invalidate(self):
+        '''
+        Forces the next call to render() to redraw the screen.
+        '''
+        self._invalidated = True
+
+    def setProfiler(self, profiler):
+        '''
+        Shows an overlay with the frame timings of the given profiler,
+        or hides it if None.
+        '''
+        if profiler:
+            self._profilerView = ProfilerView(self.context, profiler)
+        else:
+            self._profilerView = None
+        self._invalidated = True
+
     def setUI(self, ui):
+        self._invalidated = True
         if ui:
             self._ui = ui
             self._ui.dirty = True
@@ -223,6 +245,7 @@ class Display(object):
 
     def setWorld(self, world, player):
         self.clear()
+        self._invalidated = True
         world.dirty = True
         self._world = world
         self._player = player
@@ -263,7 +286,64 @@ class Display(object):
         if self._worldView:
             self._worldView.setBackground(self._uiSurface)
 
-    def render(self):
+    def isIdle(self):
+        '''
+        Returns whether the screen will stay the same until the next input.
+        '''
+        if _gameState.state == GameState.STORY:
+            return self._story.isFinished()
+        elif _gameState.state == GameState.ENDGAME:
+            return self._endStory != None and self._endStory.isFinished()
+        return False
+
+    def _getRenderState(self, interpolation):
+        '''
+        Returns a value which changes whenever the rendered screen changes,
+        or None if it must be redrawn anyway.
+        '''
+        for particleView in self.context._particlesViews:
+            if particleView.isActive():
+                return None
+        if self._profilerView and self._profilerView.needsRefresh():
+            return None
+        state = [_gameState.state, _gameState.duration]
+        if _gameState.state == GameState.STORY:
+            state.append(self._story.getProgress())
+        elif _gameState.state == GameState.ENDGAME:
+            if self._endStory:
+                state.append(self._endStory.getProgress())
+        elif self._worldView:
+            state.append(self._worldView.getRenderState())
+            edge = self._edgeView.edge
+            if edge:
+                state.append((edge.id, edge.markedLength))
+        if self._ui and self._ui.dirty:
+            return None
+        for entity in self._entities:
+            entityState = entity.getRenderState(interpolation)
+            if entityState == None:
+                return None
+            state.append(entityState)
+        return state
+
+    def render(self, interpolation = 1.0):
+        '''
+        Renders the screen, unless nothing changed since the last call.
+        @param interpolation: position between the last tick and the next one,
+        used to smooth the entity movements
+        @return: True if the screen was rendered and needs to be flipped
+        '''
+        renderState = self._getRenderState(interpolation)
+        if not self._invalidated and renderState != None and renderState == self._lastRenderState:
+            return False
+        self._invalidated = False
+        self._lastRenderState = renderState
+        self._render(interpolation)
+        if self._profilerView:
+            self._profilerView.render(self.context.screen)
+        return True
+
+    def _render(self, interpolation):
         surface = self.context.screen
         if _gameState.state == GameState.QUIT:
             surface.blit(self._background, (0,0))
@@ -287,7 +367,7 @@ class Display(object):
             particleView.render(surface)
 
         for entity in self._entities:
-            entity.render(surface)
+            entity.render(surface, interpolation)
         if self._gameState.state == GameState.TITLE:
             self._titleScreen.render()
         self.selectionView.render(surface)
@@ -317,6 +397,7 @@ class Display(object):
             self.context._particlesViews = []
 
         for entity in self._entities:
+            entity.savePosition()
             entity.update()
 
     def addEntityView(self, entityView):
@@ -328,6 +409,8 @@ class Display(object):
 class WorldView(object):
     '''
     '''
+    # how far the node and arrow sprites extend from a node position
+    SPRITE_MARGIN = 10
 
     def __init__(self, context, world):
         self._context = context
@@ -335,6 +418,9 @@ class WorldView(object):
         self._background = self._context.screen.copy()
         self._background.fill((0, 0, 0))
         self._worldSurface = self._context.screen.copy()
+        # position in the world's change journal at the last rendering
+        self._journalPosition = 0
+        self._world.dirty = True
 
     def setBackground(self, background):
         self._background = background
@@ -342,82 +428,139 @@ class WorldView(object):
 
     def _rerender(self):
         surface = self._worldSurface
+        surface.blit(self._background, (0, 0))
         # render edges
         for edge in self._world.edges:
-            width = 3
-            if edge.isMarked():
-                color = (0, 255, 255)
-            else:
-                color = (128, 128, 128)
-
-            # HACK: pygame.draw.line doesn't apply the width around the position,
-            # so need to shift it manually
-            drawLine(surface, color, edge.source.pos, edge.destination.pos, width )
-            if edge.oneWay and edge.destination.type != model.Node.JOINT:
-                # Draw arrow
-                dir = unitVector(vectorDiff(edge.destination.pos, edge.source.pos))
-                # I used to calculate this, but time is against me now,
-                # so just hard-coding it
-                if dir[0] == 0:
-                    if dir[1] < 0:
-                        spriteIndex = SPRITE_ARROW_UP
-                        offset = (-6, 4)
-                    else:
-                        spriteIndex = SPRITE_ARROW_DOWN
-                        offset = (-6, -10)
-                else:
-                    if dir[0] < 0:
-                        spriteIndex = SPRITE_ARROW_LEFT
-                        offset = (4, -6)
-                    else:
-                        spriteIndex = SPRITE_ARROW_RIGHT
-                        offset = (-10, -6)
-                if edge.isMarked():
-                    spriteIndex += 4
-                pos = vectorAdd(edge.destination.pos, offset)
-                drawSprite(surface, spriteIndex, pos)
-
-            if debug:
-                textSurface = self._context.normalFont.render("%i" % edge.length, False, (0, 128, 128))
-                x1 = edge.source.pos[0]
-                x2 = edge.destination.pos[0]
-                y = edge.source.pos[1]
-                if x1 == x2:
-                    x = x1 + 5
-                    y1 = edge.source.pos[1]
-                    y2 = edge.destination.pos[1]
-                    if y1 > y2:
-                        aux = y1
-                        y1 = y2
-                        y2 = aux
-                    y = y1 + (y2 - y1) / 2 - 10
-                else:
-                    if x1 > x2:
-                        aux = x1
-                        x1 = x2
-                        x2 = aux
-                    x = x1 + (x2 - x1) / 2 - 10
-                surface.blit(textSurface, (x, y))
+            self._renderEdge(surface, edge)
 
         # render nodes
-        d = 5
         for node in self._world.nodes:
-            if node.type == model.Node.SQUARE:
-                if node.marked:
-                    spriteIndex = SPRITE_NODE_ACTIVE
-                else:
-                    spriteIndex = SPRITE_NODE_NORMAL
-                pos = (node.pos[0] - d, node.pos[1] - d)
-                drawSprite(surface, spriteIndex, pos)
-                if debug:
-                    textSurface = self._context.normalFont.render("%i" % node.id, False, (255, 255, 0))
-                    surface.blit(textSurface, (node.pos[0] + 2, node.pos[1] + d * 2 + 2))
+            self._renderNode(surface, node)
         self._world.dirty = False
+        self._journalPosition = self._world.journal.getPosition()
+
+    def _renderChanges(self):
+        '''
+        Redraws only the areas of the edges and nodes which changed since
+        the last rendering. Returns False if a full redraw is needed instead.
+        '''
+        changes = self._world.journal.getChangesSince(self._journalPosition)
+        if changes == None:
+            return False
+        areas = []
+        for tick, change, obj in changes:
+            if change != model.ChangeJournal.MARKED:
+                # erasing or moving needs the background, redraw all
+                return False
+            if isinstance(obj, model.Edge):
+                pos1 = obj.source.pos
+                pos2 = obj.destination.pos
+            else:
+                pos1 = pos2 = obj.pos
+            margin = self.SPRITE_MARGIN
+            areas.append((min(pos1[0], pos2[0]) - margin, min(pos1[1], pos2[1]) - margin,
+                          max(pos1[0], pos2[0]) + margin, max(pos1[1], pos2[1]) + margin))
+        for area in areas:
+            self._rerenderArea(area)
+        self._journalPosition = self._world.journal.getPosition()
+        return True
+
+    def _rerenderArea(self, area):
+        '''
+        Redraws the background, edges and nodes inside the given area (x1, y1, x2, y2).
+        '''
+        surface = self._worldSurface
+        rect = pygame.Rect(area[0], area[1], area[2] - area[0] + 1, area[3] - area[1] + 1)
+        surface.set_clip(rect)
+        surface.blit(self._background, rect.topleft, rect)
+        # sprites of the elements around can overlap the area
+        margin = self.SPRITE_MARGIN
+        searchArea = (area[0] - margin, area[1] - margin, area[2] + margin, area[3] + margin)
+        # keep the drawing order of a full redraw
+        for edge in sorted(self._world.getEdgesInRect(searchArea), key = lambda edge: edge.id):
+            self._renderEdge(surface, edge)
+        for node in sorted(self._world.getNodesInRect(searchArea), key = lambda node: node.id):
+            self._renderNode(surface, node)
+        surface.set_clip(None)
+
+    def _renderEdge(self, surface, edge):
+        width = 3
+        if edge.isMarked():
+            color = (0, 255, 255)
+        else:
+            color = (128, 128, 128)
+
+        # HACK: pygame.draw.line doesn't apply the width around the position,
+        # so need to shift it manually
+        drawLine(surface, color, edge.source.pos, edge.destination.pos, width )
+        if edge.oneWay and edge.destination.type != model.Node.JOINT:
+            # Draw arrow
+            dir = unitVector(vectorDiff(edge.destination.pos, edge.source.pos))
+            # I used to calculate this, but time is against me now,
+            # so just hard-coding it
+            if dir[0] == 0:
+                if dir[1] < 0:
+                    spriteIndex = SPRITE_ARROW_UP
+                    offset = (-6, 4)
+                else:
+                    spriteIndex = SPRITE_ARROW_DOWN
+                    offset = (-6, -10)
+            else:
+                if dir[0] < 0:
+                    spriteIndex = SPRITE_ARROW_LEFT
+                    offset = (4, -6)
+                else:
+                    spriteIndex = SPRITE_ARROW_RIGHT
+                    offset = (-10, -6)
+            if edge.isMarked():
+                spriteIndex += 4
+            pos = vectorAdd(edge.destination.pos, offset)
+            drawSprite(surface, spriteIndex, pos)
+
+        if debug:
+            textSurface = self._context.normalFont.render("%i" % edge.length, False, (0, 128, 128))
+            x1 = edge.source.pos[0]
+            x2 = edge.destination.pos[0]
+            y = edge.source.pos[1]
+            if x1 == x2:
+                x = x1 + 5
+                y1 = edge.source.pos[1]
+                y2 = edge.destination.pos[1]
+                if y1 > y2:
+                    aux = y1
+                    y1 = y2
+                    y2 = aux
+                y = y1 + (y2 - y1) / 2 - 10
+            else:
+                if x1 > x2:
+                    aux = x1
+                    x1 = x2
+                    x2 = aux
+                x = x1 + (x2 - x1) / 2 - 10
+            surface.blit(textSurface, (x, y))
+
+    def _renderNode(self, surface, node):
+        d = 5
+        if node.type == model.Node.SQUARE:
+            if node.marked:
+                spriteIndex = SPRITE_NODE_ACTIVE
+            else:
+                spriteIndex = SPRITE_NODE_NORMAL
+            pos = (node.pos[0] - d, node.pos[1] - d)
+            drawSprite(surface, spriteIndex, pos)
+            if debug:
+                textSurface = self._context.normalFont.render("%i" % node.id, False, (255, 255, 0))
+                surface.blit(textSurface, (node.pos[0] + 2, node.pos[1] + d * 2 + 2))
+
+    def getRenderState(self):
+        '''
+        Returns a value which changes whenever the world needs to be redrawn.
+        '''
+        return (self._world.dirty, self._world.journal.getPosition())
 
     def render(self):
-        # pre-render level, only re-render if dirty
-        if self._world.dirty:
-            self._worldSurface.blit(self._background, (0, 0))
+        # pre-render level, only re-render what changed
+        if self._world.dirty or not self._renderChanges():
             self._rerender()
         self._context.screen.blit(self._worldSurface, (0, 0))
 
@@ -489,6 +632,15 @@ class Story(object):
         self._currentText = ""
         self._delay = 0
 
+    def isFinished(self):
+        return self._rowIndex >= len(self._text)
+
+    def getProgress(self):
+        '''
+        Returns the position of the typed text.
+        '''
+        return (self._rowIndex, self._textIndex)
+
     def update(self):
         if self._delay > 0:
             self._delay -= 1
@@ -554,11 +706,37 @@ class Particle(object):
 class EntityView(object):
     def __init__(self, entity):
         self._entity = entity
+        # entity position at the last two ticks
+        self._previousPos = entity.pos
+        self._lastPos = entity.pos
+
+    def savePosition(self):
+        '''
+        Called after every tick, to interpolate the rendered position
+        between the last two ticks.
+        '''
+        self._previousPos = self._lastPos
+        self._lastPos = self._entity.pos
+
+    def getRenderPos(self, interpolation):
+        pos = self._entity.pos
+        if interpolation >= 1.0 or pos != self._lastPos:
+            return pos
+        previousPos = self._previousPos
+        return (int(previousPos[0] + (pos[0] - previousPos[0]) * interpolation),
+                int(previousPos[1] + (pos[1] - previousPos[1]) * interpolation))
+
+    def getRenderState(self, interpolation):
+        '''
+        Returns a value which changes whenever the view needs to be redrawn,
+        or None if it must always be redrawn.
+        '''
+        return self.getRenderPos(interpolation)
 
     def update(self):
         pass
 
-    def render(self, surface):
+    def render(self, surface, interpolation = 1.0):
         pass
 
 class PlayerView(EntityView):
@@ -571,7 +749,7 @@ class PlayerView(EntityView):
             # Marking in progress
             self.particlesView.makeParticles((0, 255, 255))
 
-    def render(self, surface):
+    def render(self, surface, interpolation = 1.0):
         offset = (-10,-10)
         alpha = 255
         if _gameState.state == GameState.LEVEL_START:
@@ -582,19 +760,19 @@ class PlayerView(EntityView):
             offset = vectorAdd(offset, (random.randint(-3, 3), random.randint(-3, 3)))
             alpha = 255 - int(_gameState.getProgress() * 255)
 
-        pos = vectorAdd(self._entity.pos, offset)
+        pos = vectorAdd(self.getRenderPos(interpolation), offset)
         drawSprite(surface, SPRITE_PLAYER, pos, alpha)
 
 class FoeView(EntityView):
     def __init__(self, entity):
         EntityView.__init__(self, entity)
 
-    def render(self, surface):
+    def render(self, surface, interpolation = 1.0):
         if self._entity.foeType == 0:
             sprite = SPRITE_FOE1
         else:
             sprite = SPRITE_FOE2
-        pos = vectorAdd(self._entity.pos, (-10, -10))
+        pos = vectorAdd(self.getRenderPos(interpolation), (-10, -10))
         drawSprite(surface, sprite, pos)
 
 class ParticlesView(EntityView):
@@ -636,7 +814,7 @@ class ParticlesView(EntityView):
             particle.update()
             self._activeParticles += 1
 
-    def render(self, surface):
+    def render(self, surface, interpolation = 1.0):
         if self._activeParticles == 0:
             return
 
@@ -647,6 +825,11 @@ class ParticlesView(EntityView):
             particle.render(surface)
         surface.unlock()
 
+    def getRenderState(self, interpolation):
+        if self._activeParticles > 0:
+            return None
+        return 0
+
     def isActive(self):
         return self._activeParticles > 0
 
@@ -738,6 +921,41 @@ class Hud(object):
         #    self._scoreSurface = self._font.render("%i" % self._lastScore, False, (0, 192, 0))
         #self._screen.blit(self._scoreSurface, (0, self._screen.get_height() - self._font.get_height()))
 
+class ProfilerView(object):
+    '''
+    Overlay showing the percentiles of the frame phase durations.
+    '''
+    # number of frames between two refreshes of the values
+    refreshInterval = 60
+
+    def __init__(self, context, profiler):
+        self._profiler = profiler
+        self._font = context.smallFont
+        self._surfaces = []
+        self._lastRefresh = None
+
+    def needsRefresh(self):
+        return self._lastRefresh == None or self._profiler.frames - self._lastRefresh >= self.refreshInterval
+
+    def _refresh(self):
+        self._lastRefresh = self._profiler.frames
+        rows = ["%-7s %6s %6s %6s" % ("ms", "p50", "p95", "p99")]
+        phases = [(name, phase) for phase, name in enumerate(self._profiler.phaseNames)]
+        phases.append(("frame", None))
+        for name, phase in phases:
+            values = tuple(self._profiler.getPercentiles(phase))
+            rows.append("%-7s %6.2f %6.2f %6.2f" % ((name,) + values))
+        self._surfaces = [self._font.render(row, False, (255, 255, 0)) for row in rows]
+
+    def render(self, screen):
+        if self.needsRefresh():
+            self._refresh()
+        fontHeight = self._font.get_height()
+        width = max([surface.get_width() for surface in self._surfaces])
+        pos = (screen.get_width() - width - 5, 5)
+        screen.fill((0, 0, 0), (pos[0] - 2, pos[1] - 2, width + 4, fontHeight * len(self._surfaces) + 4))
+        blitTextSurfaces(screen, self._surfaces, fontHeight, pos)
+
 class TitleScreen(object):
     def __init__(self, context):
         self._screen = context.screen